@@ -1,26 +1,51 @@
 import streamlit as st
 import os
-import shutil
 from persistence.database import setup_database, clear_database
-from services.vector_store import load_vector_store
+from services.vector_store import load_vector_store, has_vector_store, clear_vector_stores
 from ui.ui_components import render_upload_tab, render_query_tab, render_search_tab
-from config import OPENAI_VECTOR_PATH, LLAMA_VECTOR_PATH
+from persistence.models import ModelFactory
+from config import LLAMA_WARM_ON_STARTUP
 
 
 st.set_page_config(page_title="ATOM XML Flight Data Processor", layout="wide")
 st.title("Flight Data Processor and Query System")
 
+
+@st.cache_resource
+def warm_llama_models():
+    # Runs once per process; the models are shared by every session
+    ModelFactory.warm_llama_models()
+    return True
+
+
+if LLAMA_WARM_ON_STARTUP:
+    warm_llama_models()
+
+
+@st.cache_resource
+def init_database():
+    # Schema setup runs once per process; connections come from the shared pool
+    return setup_database()
+
+
+init_database()
+
 # Initialize session state
 if "use_openai" not in st.session_state:
     st.session_state.use_openai = True
 if "processed_files" not in st.session_state:
     st.session_state.processed_files = False
-if "database_conn" not in st.session_state:
-    st.session_state.database_conn = setup_database()
 if "vector_store" not in st.session_state:
     st.session_state.vector_store = None
 if "api_key" not in st.session_state:
     st.session_state.api_key = None
+if "query_sql" not in st.session_state:
+    st.session_state.query_sql = None
+    st.session_state.query_cursors = [None]
+if "query_export_path" not in st.session_state:
+    st.session_state.query_export_path = None
+if "index_advice" not in st.session_state:
+    st.session_state.index_advice = None
 
 # UI for model selection and API key
 with st.sidebar:
@@ -43,9 +68,7 @@ with st.sidebar:
         st.info("Using LLaMA model - no API key required")
         st.session_state.api_key = None
 
-    vector_path = OPENAI_VECTOR_PATH if use_openai else LLAMA_VECTOR_PATH
-
-    if os.path.exists(vector_path) and os.path.isdir(vector_path):
+    if has_vector_store(use_openai):
         if st.button("Load Existing Vector Store"):
             with st.spinner("Loading vector store..."):
                 st.session_state.vector_store = load_vector_store(
@@ -62,32 +85,19 @@ with st.sidebar:
 with st.sidebar:
     st.header("Database Management")
 
-    if st.session_state.database_conn:
-        if st.button("Clear Database"):
-            try:
-                if clear_database():
-                    for path in [OPENAI_VECTOR_PATH, LLAMA_VECTOR_PATH]:
-                        if os.path.exists(path):
-                            try:
-                                shutil.rmtree(path)
-                            except Exception as e:
-                                st.error(f"Failed to remove vector store: {str(e)}")
-                                for root, dirs, files in os.walk(path):
-                                    for dir in dirs:
-                                        os.chmod(os.path.join(root, dir), 0o755)
-                                    for file in files:
-                                        os.chmod(os.path.join(root, file), 0o644)
-                                try:
-                                    shutil.rmtree(path)
-                                except:
-                                    pass
-
-                    st.session_state.vector_store = None
-                    st.session_state.processed_files = False
-                    st.success("Database and vector stores cleared")
-                    st.rerun()
-            except Exception as e:
-                st.error(f"Failed to clear database: {str(e)}")
+    if st.button("Clear Database"):
+        try:
+            if clear_database():
+                # Other sessions may still be searching, so the stores are
+                # retired and removed after a grace period instead of deleted now
+                clear_vector_stores()
+
+                st.session_state.vector_store = None
+                st.session_state.processed_files = False
+                st.success("Database and vector stores cleared")
+                st.rerun()
+        except Exception as e:
+            st.error(f"Failed to clear database: {str(e)}")
 
 
 # Create tabs for different functionalities
@@ -106,9 +116,7 @@ with tab3:
 
 # Display cache status
 st.subheader("Cache Status")
-vector_path = OPENAI_VECTOR_PATH if st.session_state.use_openai else LLAMA_VECTOR_PATH
-
-if os.path.exists(vector_path):
+if has_vector_store(st.session_state.use_openai):
     st.success(f"Vector embeddings are cached locally for {'OpenAI' if st.session_state.use_openai else 'LLaMA'}")
     if st.session_state.use_openai:
         st.info("This saves on OpenAI API calls")
@@ -0,0 +1,61 @@
+import os
+import json
+import time
+import argparse
+import numpy as np
+from persistence.numpy_vector_store import QUANTIZATIONS, encode_vectors, exact_search, quantized_search
+
+# Recall@k and scan size of each quantization against exact float32 search.
+#   python benchmark_quantization.py --rows 200000 --dim 1536
+#   python benchmark_quantization.py --store flight_vectors_openai/numpy
+
+
+def load_vectors(args):
+    if args.store:
+        with open(os.path.join(args.store, "store.json")) as info_file:
+            info = json.load(info_file)
+        path = os.path.join(args.store, f"vectors.{info['generation']}.f32")
+        return np.fromfile(path, dtype=np.float32).reshape(-1, info["dim"])
+
+    # Clustered like flight documents: many near-duplicates around few topics
+    rng = np.random.default_rng(args.seed)
+    centres = rng.standard_normal((max(args.rows // 500, 1), args.dim)).astype(np.float32)
+    assignment = rng.integers(0, len(centres), args.rows)
+    return centres[assignment] + 0.5 * rng.standard_normal((args.rows, args.dim)).astype(np.float32)
+
+
+def run(args):
+    vectors = load_vectors(args)
+    norms = np.linalg.norm(vectors, axis=1)
+    rng = np.random.default_rng(args.seed + 1)
+    queries = vectors[rng.integers(0, len(vectors), args.queries)]
+    queries = queries + 0.3 * rng.standard_normal(queries.shape).astype(np.float32)
+
+    exact = [set(exact_search(vectors, norms, query, args.k).tolist()) for query in queries]
+    print(f"{len(vectors)} vectors x {vectors.shape[1]} dims, {args.queries} queries, k={args.k}")
+    print(f"{'codes':<8}{'rerank':>8}{'recall':>9}{'scan MB':>10}{'ms/query':>10}")
+    print(f"{'float32':<8}{'-':>8}{1.0:>9.3f}{vectors.nbytes / 2**20:>10.1f}{'-':>10}")
+
+    for quantization in QUANTIZATIONS:
+        codes = encode_vectors(vectors, quantization)
+        for factor in args.rerank_factors:
+            hits = 0
+            started = time.perf_counter()
+            for query, expected in zip(queries, exact):
+                found = quantized_search(vectors, norms, codes, quantization, query, args.k, rerank_factor=factor)
+                hits += len(expected & set(found.tolist()))
+            elapsed = (time.perf_counter() - started) / len(queries) * 1000
+            recall = hits / (len(queries) * args.k)
+            print(f"{quantization:<8}{factor:>8}{recall:>9.3f}{codes.nbytes / 2**20:>10.1f}{elapsed:>10.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark quantized vector search recall against memory")
+    parser.add_argument("--store", help="NumPy vector store directory to read vectors from")
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--rerank-factors", type=int, nargs="+", default=[1, 4, 10, 30])
+    parser.add_argument("--seed", type=int, default=7)
+    run(parser.parse_args())
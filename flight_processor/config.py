@@ -1,4 +1,17 @@
+import os
+
 DATABASE_PATH = "database/relational/flight_data.db"
+SQLITE_READ_POOL_SIZE = 8
+SQLITE_POOL_TIMEOUT = 30
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "mmap_size": 256 * 1024 ** 2,
+    "cache_size": -64 * 1024,
+    "busy_timeout": 5000,
+    "temp_store": "MEMORY",
+    "foreign_keys": "ON",
+}
 OPENAI_VECTOR_PATH = "database/vector/flight_vectors_openai"
 LLAMA_VECTOR_PATH = "database/vector/flight_vectors_llama"
 
@@ -7,8 +20,53 @@ LLM_TEMPERATURE = 0
 
 LLAMA_MODEL_PATH = "llm/llama-2-7b-chat.Q8_0.gguf"
 LLAMA_MODEL_N_CTX = 4096
+# Tokens of search hits in an answer prompt, and tokens kept free for the answer itself
+ANSWER_CONTEXT_TOKENS = 1024
+ANSWER_MAX_TOKENS = 256
+# Hits fetched per search: the best VECTOR_SEARCH_TOP_K are shown, all may feed the answer
+ANSWER_CONTEXT_HITS = 20
+LLAMA_WARM_ON_STARTUP = False
+LLAMA_IDLE_UNLOAD_SECONDS = 30 * 60
+LLAMA_EMBED_BATCH_SIZE = 64
+LLAMA_EMBED_N_BATCH = 2048
+LLAMA_EMBED_WORKERS = max(1, min(4, (os.cpu_count() or 1) // 4))
 
+# "chroma", or "numpy" for the memory-mapped flat store kept under <vector path>/numpy
+VECTOR_BACKEND = "chroma"
+NUMPY_SEARCH_BLOCK_ROWS = 64 * 1024
+NUMPY_COMPACT_DEAD_FRACTION = 0.3
+# None, "int8" (4x smaller scans) or "binary" (32x); full vectors stay on disk for
+# re-ranking the best k * NUMPY_RERANK_FACTOR candidates
+NUMPY_QUANTIZATION = None
+NUMPY_RERANK_FACTOR = 10
+# One vector store per origin date; date-filtered searches open only the days in range
+VECTOR_SHARD_BY_DATE = False
+VECTOR_SHARD_CACHE_SIZE = 32
+# Index only this many days back from the latest schedule date (None keeps all)
+VECTOR_RETENTION_DAYS = None
+# How long a replaced vector store version is kept for searches still reading it
+VECTOR_VERSION_GRACE_SECONDS = 600
 VECTOR_SEARCH_TOP_K = 3
+VECTOR_MANIFEST_FILE = "index_manifest.db"
+VECTOR_UPSERT_BATCH_SIZE = 256
+AIRPORT_DATA_PATH = "data/airports.csv.gz"
+# Hybrid search fuses this many lexical and vector candidates by reciprocal rank
+HYBRID_CANDIDATES = 20
+HYBRID_RRF_K = 60
+SEARCH_CACHE_MAX_BYTES = 16 * 1024 ** 2
+HYDE_CACHE_MAX_BYTES = 32 * 1024 ** 2
+
+EMBEDDING_CACHE_PATH = "database/cache/embeddings.db"
+EMBEDDING_CACHE_MAX_BYTES = 2 * 1024 ** 3
+
+BULK_INSERT_CHUNK_SIZE = 500
+INGEST_PARSE_WORKERS = max(1, min(8, (os.cpu_count() or 2) - 1))
+# Uploads are copied to disk for the parser workers this many bytes at a time
+INGEST_SPOOL_BLOCK_BYTES = 1024 ** 2
+OPENAI_MAX_CONCURRENCY = 8
+
+# Run the deterministic ATOM parser first and only ask OpenAI for what it missed
+TIERED_EXTRACTION = True
 
 EXAMPLE_QUERIES = {
     "All flights": "SELECT * FROM flights",
@@ -39,7 +97,52 @@ FLIGHTS_TABLE_SCHEMA = '''
                                                               aircraft_type TEXT,
                                                               aircraft_owner_airline TEXT,
                                                               capacity INTEGER,
-                                                              raw_data TEXT,
                                                               UNIQUE(airline, flight_number, origin_date_local, departure_port, arrival_port)
                        ) \
-                       '''
\ No newline at end of file
+                       '''
+
+# Filters on airline are already served by the UNIQUE(airline, ...) index
+FLIGHTS_TABLE_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_flights_route ON flights(departure_port, arrival_port)",
+    "CREATE INDEX IF NOT EXISTS idx_flights_arrival_port ON flights(arrival_port)",
+    "CREATE INDEX IF NOT EXISTS idx_flights_origin_date_local ON flights(origin_date_local)",
+    "CREATE INDEX IF NOT EXISTS idx_flights_aircraft_type ON flights(aircraft_type)",
+]
+
+# Raw ATOM payloads live compressed in their own table, away from the hot rows
+FLIGHT_RAW_DATA_TABLE_SCHEMA = '''
+                               CREATE TABLE IF NOT EXISTS flight_raw_data (
+                                                                              flight_id INTEGER PRIMARY KEY REFERENCES flights(id) ON DELETE CASCADE,
+                                                                              codec TEXT,
+                                                                              payload BLOB
+                               ) \
+                               '''
+RAW_DATA_COMPRESSION_LEVEL = 6
+
+INDEX_ADVISOR_MAX_QUERIES = 200
+
+QUERY_PAGE_SIZE = 100
+QUERY_DISPLAY_ROW_CAP = 1000
+QUERY_FETCH_SIZE = 5000
+QUERY_CACHE_MAX_BYTES = 64 * 1024 ** 2
+# st.download_button holds the whole export in memory while it is shown
+QUERY_EXPORT_MAX_BYTES = 200 * 1024 ** 2
+QUERY_EXPORT_MAX_AGE_SECONDS = 60 * 60
+
+INGESTED_FILES_TABLE_SCHEMA = '''
+                              CREATE TABLE IF NOT EXISTS ingested_files (
+                                                                            content_hash TEXT PRIMARY KEY,
+                                                                            file_name TEXT,
+                                                                            ingested_at TEXT DEFAULT CURRENT_TIMESTAMP
+                              ) \
+                              '''
+
+EXTRACTION_CACHE_TABLE_SCHEMA = '''
+                                CREATE TABLE IF NOT EXISTS extraction_cache (
+                                                                                content_hash TEXT,
+                                                                                extractor TEXT,
+                                                                                data TEXT,
+                                                                                created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                                                                                PRIMARY KEY (content_hash, extractor)
+                                ) \
+                                '''
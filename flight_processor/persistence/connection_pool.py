@@ -0,0 +1,134 @@
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from config import SQLITE_PRAGMAS, SQLITE_READ_POOL_SIZE, SQLITE_POOL_TIMEOUT
+
+
+class ConnectionPool:
+    def __init__(self, path, readers=SQLITE_READ_POOL_SIZE, timeout=SQLITE_POOL_TIMEOUT):
+        self.path = path
+        self.max_readers = readers
+        self.timeout = timeout
+        self._idle_readers = queue.LifoQueue()
+        self._reader_count = 0
+        self._lock = threading.Lock()
+        self._writer = None
+        # A single writer connection; SQLite only ever admits one writer anyway
+        self._writer_lock = threading.RLock()
+        # How many transaction() blocks the lock holder is inside
+        self._transaction_depth = 0
+
+    @contextmanager
+    def reader(self):
+        conn = self._take_reader()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            self._idle_readers.put(conn)
+
+    @contextmanager
+    def writer(self):
+        if not self._writer_lock.acquire(timeout=self.timeout):
+            raise sqlite3.OperationalError("Timed out waiting for the database writer")
+        try:
+            if self._writer is None:
+                self._writer = self._connect(read_only=False)
+            yield self._writer
+        finally:
+            self._writer_lock.release()
+
+    @contextmanager
+    def transaction(self):
+        with self.writer() as conn:
+            if self._transaction_depth:
+                # Nested use on the same thread joins the outer transaction
+                self._transaction_depth += 1
+                try:
+                    yield conn
+                finally:
+                    self._transaction_depth -= 1
+                return
+
+            if conn.in_transaction:
+                # Left open by an earlier failure; never build on top of it
+                self._rollback(conn)
+                conn = self._writer = self._writer or self._connect(read_only=False)
+
+            conn.execute("BEGIN IMMEDIATE")
+            self._transaction_depth = 1
+            try:
+                try:
+                    yield conn
+                except BaseException:
+                    self._rollback(conn)
+                    raise
+                try:
+                    conn.execute("COMMIT")
+                except BaseException:
+                    # A failed COMMIT (locked, disk I/O) leaves the transaction open
+                    self._rollback(conn)
+                    raise
+            finally:
+                self._transaction_depth = 0
+
+    def _rollback(self, conn):
+        try:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+        except sqlite3.Error:
+            # The connection is in an unknown state; the next writer gets a fresh one
+            conn.close()
+            self._writer = None
+
+    def close(self):
+        with self._writer_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+        with self._lock:
+            while True:
+                try:
+                    self._idle_readers.get_nowait().close()
+                except queue.Empty:
+                    break
+            self._reader_count = 0
+
+    def _take_reader(self):
+        try:
+            return self._idle_readers.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if self._reader_count < self.max_readers:
+                self._reader_count += 1
+                create = True
+            else:
+                create = False
+
+        if create:
+            try:
+                return self._connect(read_only=True)
+            except Exception:
+                with self._lock:
+                    self._reader_count -= 1
+                raise
+
+        try:
+            return self._idle_readers.get(timeout=self.timeout)
+        except queue.Empty:
+            raise sqlite3.OperationalError("Timed out waiting for a database connection")
+
+    def _connect(self, read_only):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        # Connections move between threads but are only ever used by one at a time
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        for pragma, value in SQLITE_PRAGMAS.items():
+            conn.execute(f"PRAGMA {pragma} = {value}")
+        if read_only:
+            conn.execute("PRAGMA query_only = ON")
+        return conn
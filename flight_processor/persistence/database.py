@@ -1,119 +1,360 @@
+import re
+import csv
+import zlib
 import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
 import streamlit as st
-from config import DATABASE_PATH, FLIGHTS_TABLE_SCHEMA
+from persistence.connection_pool import ConnectionPool
+from persistence.query_cache import query_cache, normalize_sql
+from config import (
+    DATABASE_PATH, FLIGHTS_TABLE_SCHEMA, FLIGHTS_TABLE_INDEXES, INGESTED_FILES_TABLE_SCHEMA,
+    EXTRACTION_CACHE_TABLE_SCHEMA, FLIGHT_RAW_DATA_TABLE_SCHEMA, RAW_DATA_COMPRESSION_LEVEL, BULK_INSERT_CHUNK_SIZE, INDEX_ADVISOR_MAX_QUERIES,
+    QUERY_PAGE_SIZE, QUERY_DISPLAY_ROW_CAP, QUERY_FETCH_SIZE
+)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+# Most recently run ad-hoc queries and how often each ran, for the index advisor
+_query_log = OrderedDict()
+_query_log_lock = threading.Lock()
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_PARENTHESIZED = re.compile(r"\([^()]*\)")
+_OUTER_ORDER_BY = re.compile(r"\bORDER\s+BY\s+(.+?)(?=\bLIMIT\b|$)", re.IGNORECASE | re.DOTALL)
+_ID_ASCENDING = re.compile(r'^(?:\w+\.)?"?id"?(?:\s+ASC)?$', re.IGNORECASE)
+
+
+def get_connection_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ConnectionPool(DATABASE_PATH)
+        return _pool
+
+
+def read_connection():
+    return get_connection_pool().reader()
+
+
+@contextmanager
+def write_transaction():
+    try:
+        with get_connection_pool().transaction() as conn:
+            yield conn
+    finally:
+        # Every write moves the data version on, so no cached read outlives it
+        query_cache.invalidate()
 
 
 def setup_database():
-    conn = sqlite3.connect(DATABASE_PATH)
-    cursor = conn.cursor()
-    cursor.execute(FLIGHTS_TABLE_SCHEMA)
-    conn.commit()
-    return conn
+    with write_transaction() as conn:
+        conn.execute(FLIGHTS_TABLE_SCHEMA)
+        for index_sql in FLIGHTS_TABLE_INDEXES:
+            conn.execute(index_sql)
+        conn.execute(INGESTED_FILES_TABLE_SCHEMA)
+        conn.execute(EXTRACTION_CACHE_TABLE_SCHEMA)
+        conn.execute(FLIGHT_RAW_DATA_TABLE_SCHEMA)
+        _migrate_inline_raw_data(conn)
+    return True
+
+
+def _migrate_inline_raw_data(conn):
+    # Older databases kept the XML in flights.raw_data; move it out compressed
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(flights)").fetchall()]
+    if "raw_data" not in columns:
+        return
+
+    cursor = conn.execute("SELECT id, raw_data FROM flights WHERE raw_data IS NOT NULL")
+    while True:
+        rows = cursor.fetchmany(BULK_INSERT_CHUNK_SIZE)
+        if not rows:
+            break
+        _store_raw_data(conn, rows)
+    conn.execute("ALTER TABLE flights DROP COLUMN raw_data")
+
+
+FLIGHT_COLUMNS = (
+    "airline", "airline2", "flight_number", "origin_date_local", "origin_date_utc",
+    "domain", "category", "departure_port", "departure_country", "departure_time",
+    "arrival_port", "arrival_country", "arrival_time", "status", "aircraft_registration",
+    "aircraft_type", "aircraft_owner_airline", "capacity"
+)
+
+# What a search result shows, so hydrating hits never reads whole rows
+FLIGHT_DISPLAY_COLUMNS = (
+    "id", "airline", "flight_number", "origin_date_local", "departure_port", "departure_time",
+    "arrival_port", "arrival_time", "aircraft_type", "aircraft_registration", "status"
+)
 
+# SQLite caps bound parameters per statement, so id lookups are issued in slices
+_ID_LOOKUP_CHUNK_SIZE = 500
 
-def get_db_connection():
-    return sqlite3.connect(DATABASE_PATH)
+INSERT_FLIGHT_SQL = f"""
+INSERT OR REPLACE INTO flights
+({", ".join(FLIGHT_COLUMNS)})
+VALUES ({", ".join("?" for _ in FLIGHT_COLUMNS)})
+"""
 
+INSERT_RAW_DATA_SQL = "INSERT OR REPLACE INTO flight_raw_data (flight_id, codec, payload) VALUES (?, ?, ?)"
 
-def store_flight_data(data):
-    conn = get_db_connection()
-    cursor = conn.cursor()
+RAW_DATA_CODEC = "zlib"
+
+
+def _flight_row(data):
+    return tuple(data.get(column) for column in FLIGHT_COLUMNS)
+
+
+def _compress_raw_data(raw_data):
+    return zlib.compress(raw_data.encode("utf-8"), RAW_DATA_COMPRESSION_LEVEL)
+
+
+def _store_raw_data(cursor, entries):
+    cursor.executemany(INSERT_RAW_DATA_SQL, [(flight_id, RAW_DATA_CODEC, _compress_raw_data(raw_data))
+                                             for flight_id, raw_data in entries if raw_data is not None])
+
+
+def store_flights_bulk(flights, chunk_size=BULK_INSERT_CHUNK_SIZE):
+    # Each chunk commits on its own, so the write lock is only held while a
+    # chunk is written, never while the caller is still producing flights
+    results = []
+    chunk = []
 
     try:
-        cursor.execute('''
-        INSERT OR REPLACE INTO flights
-        (airline, airline2, flight_number, origin_date_local, origin_date_utc,
-         domain, category, departure_port, departure_country, departure_time,
-         arrival_port, arrival_country, arrival_time, status, aircraft_registration,
-         aircraft_type, aircraft_owner_airline, capacity, raw_data)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            data.get("airline"),
-            data.get("airline2"),
-            data.get("flight_number"),
-            data.get("origin_date_local"),
-            data.get("origin_date_utc"),
-            data.get("domain"),
-            data.get("category"),
-            data.get("departure_port"),
-            data.get("departure_country"),
-            data.get("departure_time"),
-            data.get("arrival_port"),
-            data.get("arrival_country"),
-            data.get("arrival_time"),
-            data.get("status"),
-            data.get("aircraft_registration"),
-            data.get("aircraft_type"),
-            data.get("aircraft_owner_airline"),
-            data.get("capacity"),
-            data.get("raw_data")
-        ))
-
-        conn.commit()
-        return True
+        for data in flights:
+            chunk.append(data)
+            if len(chunk) >= chunk_size:
+                results.extend(_store_flight_chunk(chunk))
+                chunk = []
+        if chunk:
+            results.extend(_store_flight_chunk(chunk))
+            chunk = []
+    except Exception as e:
+        # Producing the flights failed; the rows taken since the last chunk are not stored
+        st.error(f"Database error: {str(e)}")
+        results.extend([False] * len(chunk))
+    return results
 
+
+def _store_flight_chunk(chunk):
+    try:
+        with write_transaction() as conn:
+            return _write_flight_chunk(conn.cursor(), chunk)
     except Exception as e:
         st.error(f"Database error: {str(e)}")
-        return False
-    finally:
-        conn.close()
+        return [False] * len(chunk)
+
+
+@contextmanager
+def _savepoint(cursor, name):
+    cursor.execute(f"SAVEPOINT {name}")
+    try:
+        yield
+    except BaseException:
+        cursor.execute(f"ROLLBACK TO {name}")
+        cursor.execute(f"RELEASE {name}")
+        raise
+    cursor.execute(f"RELEASE {name}")
+
+
+def _write_flight_chunk(cursor, chunk):
+    try:
+        with _savepoint(cursor, "flight_chunk"):
+            rows = [_flight_row(data) for data in chunk]
+            # AUTOINCREMENT hands out ids strictly above sqlite_sequence, and we hold
+            # the only write transaction, so the chunk gets consecutive ids after it
+            sequence = cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = 'flights'").fetchone()
+            first_id = (sequence[0] if sequence else 0) + 1
+            cursor.executemany(INSERT_FLIGHT_SQL, rows)
+            _store_raw_data(cursor, [(first_id + offset, data.get("raw_data")) for offset, data in enumerate(chunk)])
+        return [True] * len(chunk)
+    except Exception:
+        pass
+
+    # Replay the failed chunk row by row so one bad flight only fails itself;
+    # each row has its own savepoint so a half-written one leaves nothing behind
+    results = []
+    for data in chunk:
+        try:
+            with _savepoint(cursor, "flight_row"):
+                cursor.execute(INSERT_FLIGHT_SQL, _flight_row(data))
+                _store_raw_data(cursor, [(cursor.lastrowid, data.get("raw_data"))])
+            results.append(True)
+        except Exception:
+            results.append(False)
+    return results
+
+
+def _cached_read(query, params, loader):
+    return query_cache.get_or_load((normalize_sql(query), params), loader)
 
 
 def get_flight_count():
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT COUNT(*) FROM flights")
-    count = cursor.fetchone()[0]
-    conn.close()
-    return count
+    query = "SELECT COUNT(*) FROM flights"
+    return _cached_read(query, (), lambda: _run_query(query)[1][0][0])
 
 
 def get_flight_sample(limit=10):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(f"""
-    SELECT airline, flight_number, origin_date_local,
-           departure_port, departure_time,
-           arrival_port, arrival_time, status
-    FROM flights LIMIT {limit}
-    """)
+    query = """
+        SELECT airline, flight_number, origin_date_local,
+               departure_port, departure_time,
+               arrival_port, arrival_time, status
+        FROM flights LIMIT ?
+        """
+    return _cached_read(query, (limit,), lambda: _run_query(query, (limit,)))
+
+
+def get_airline_codes():
+    # Maps both the ICAO code and its IATA alias to the code stored in flights.airline
+    query = "SELECT DISTINCT airline, airline2 FROM flights WHERE airline IS NOT NULL"
+
+    def load():
+        codes = {}
+        for airline, airline2 in _run_query(query)[1]:
+            codes[airline.upper()] = airline
+            if airline2:
+                codes.setdefault(airline2.upper(), airline)
+        return codes
+
+    return _cached_read(query, (), load)
+
+
+def get_port_codes():
+    query = """
+        SELECT departure_port FROM flights WHERE departure_port IS NOT NULL
+        UNION
+        SELECT arrival_port FROM flights WHERE arrival_port IS NOT NULL
+        """
+    return _cached_read(query, (), lambda: frozenset(row[0] for row in _run_query(query)[1]))
+
+
+def get_latest_origin_date():
+    query = "SELECT MAX(origin_date_local) FROM flights"
+    return _cached_read(query, (), lambda: _run_query(query)[1][0][0])
+
+
+def _run_query(query, params=()):
+    with read_connection() as conn:
+        cursor = conn.execute(query, params)
 
-    columns = [description[0] for description in cursor.description]
-    data = cursor.fetchall()
-    conn.close()
-    return columns, data
+        columns = [description[0] for description in cursor.description]
+        return columns, cursor.fetchall()
 
 
-def execute_query(query):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(query)
+def fetch_query_page(query, cursor=None, page_size=QUERY_PAGE_SIZE):
+    page_size = min(page_size, QUERY_DISPLAY_ROW_CAP)
+    return _cached_read(query, ("page", cursor, page_size), lambda: _fetch_query_page(query, cursor, page_size))
 
-    columns = [description[0] for description in cursor.description]
-    data = cursor.fetchall()
-    conn.close()
-    return columns, data
 
+def _fetch_query_page(query, cursor, page_size):
+    # Returns the page's columns and rows, the cursor of the next page (None on
+    # the last one) and whether rows were left out because of the display cap
+    inner = query.strip().rstrip(";")
 
-def get_flight_by_id(flight_id):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM flights WHERE id = ?", (flight_id,))
+    with read_connection() as conn:
+        try:
+            columns = [description[0] for description in conn.execute(f"SELECT * FROM ({inner}) LIMIT 0").description]
+        except sqlite3.Error:
+            columns = []
 
-    columns = [description[0] for description in cursor.description]
-    flight_data = cursor.fetchone()
-    conn.close()
-    return columns, flight_data
+        if not columns:
+            # Not something that can be wrapped in a subquery, so only the
+            # first page is served, straight off the cursor
+            result = conn.execute(query)
+            return [description[0] for description in result.description], result.fetchmany(page_size), None, False
+
+        if "id" in columns and _pages_by_id(inner):
+            # Keyset pagination: each page seeks past the last id instead of
+            # OFFSET-scanning, and the order is the one the query asked for
+            id_index = columns.index("id")
+            rows = conn.execute(f"SELECT * FROM ({inner}) WHERE id > ? ORDER BY id LIMIT ?",
+                                (cursor if cursor is not None else -1, page_size)).fetchall()
+            return columns, rows, rows[-1][id_index] if len(rows) == page_size else None, False
+
+        # Any other order is kept as written and paged by offset, which rescans
+        # the skipped rows, so paging stops at the display cap
+        offset = cursor or 0
+        limit = min(page_size, QUERY_DISPLAY_ROW_CAP - offset)
+        rows = conn.execute(f"SELECT * FROM ({inner}) LIMIT ? OFFSET ?", (limit + 1, offset)).fetchall()
+        more = len(rows) > limit
+        rows = rows[:limit]
+        end = offset + len(rows)
+        return columns, rows, end if more and end < QUERY_DISPLAY_ROW_CAP else None, more and end >= QUERY_DISPLAY_ROW_CAP
+
+
+def _pages_by_id(query):
+    # Keyset paging reorders by id, so it is only used when the query has no
+    # ORDER BY of its own or is already ordered by id ascending
+    sql = _STRING_LITERAL.sub("?", query)
+    while True:
+        flattened = _PARENTHESIZED.sub(" ", sql)
+        if flattened == sql:
+            break
+        sql = flattened
+    order_by = _OUTER_ORDER_BY.search(sql)
+    return order_by is None or _ID_ASCENDING.match(order_by.group(1).strip()) is not None
+
+
+def write_query_csv(query, file_obj, chunk_size=QUERY_FETCH_SIZE):
+    writer = csv.writer(file_obj)
+    row_count = 0
+    with read_connection() as conn:
+        cursor = conn.execute(query)
+        writer.writerow([description[0] for description in cursor.description])
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            writer.writerows(rows)
+            row_count += len(rows)
+    return row_count
+
+
+def record_query(query):
+    normalized = normalize_sql(query)
+    with _query_log_lock:
+        _query_log[normalized] = _query_log.pop(normalized, 0) + 1
+        while len(_query_log) > INDEX_ADVISOR_MAX_QUERIES:
+            _query_log.popitem(last=False)
+
+
+def get_query_cache_stats():
+    return query_cache.stats()
+
+
+def get_recorded_queries():
+    with _query_log_lock:
+        return list(_query_log.items())
+
+
+def get_flights_by_ids(flight_ids, columns=FLIGHT_DISPLAY_COLUMNS):
+    flight_ids = list(dict.fromkeys(int(flight_id) for flight_id in flight_ids))
+    if not flight_ids:
+        return list(columns), []
+
+    found = {}
+    with read_connection() as conn:
+        for start in range(0, len(flight_ids), _ID_LOOKUP_CHUNK_SIZE):
+            chunk = flight_ids[start:start + _ID_LOOKUP_CHUNK_SIZE]
+            cursor = conn.execute(
+                f"SELECT id, {', '.join(columns)} FROM flights WHERE id IN ({', '.join('?' for _ in chunk)})",
+                chunk
+            )
+            found.update((row[0], row[1:]) for row in cursor.fetchall())
+
+    # Hand rows back in the order the ids were ranked, not the order SQLite found them
+    return list(columns), [found[flight_id] for flight_id in flight_ids if flight_id in found]
 
 
 def clear_database():
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM flights")
-        conn.commit()
-        conn.close()
+        with write_transaction() as conn:
+            conn.execute("DELETE FROM flight_raw_data")
+            conn.execute("DELETE FROM flights")
+            conn.execute("DELETE FROM ingested_files")
         return True
     except Exception as e:
         st.error(f"Failed to clear database: {str(e)}")
-        return False
\ No newline at end of file
+        return False
@@ -0,0 +1,132 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from array import array
+from langchain.schema.embeddings import Embeddings
+from config import EMBEDDING_CACHE_PATH, EMBEDDING_CACHE_MAX_BYTES
+
+
+class EmbeddingCacheStore:
+    def __init__(self, path=EMBEDDING_CACHE_PATH, max_bytes=EMBEDDING_CACHE_MAX_BYTES):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("""
+                           CREATE TABLE IF NOT EXISTS embeddings (
+                               key TEXT PRIMARY KEY,
+                               vector BLOB,
+                               size INTEGER,
+                               last_used REAL
+                           )
+                           """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings(last_used)")
+        self._conn.commit()
+        self._total_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM embeddings").fetchone()[0]
+
+    def get_many(self, keys):
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({', '.join('?' for _ in chunk)})",
+                    chunk
+                ).fetchall()
+                found.update((key, _decode(vector)) for key, vector in rows)
+
+            if found:
+                now = time.time()
+                self._conn.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?",
+                                       [(now, key) for key in found])
+                self._conn.commit()
+        return found
+
+    def put_many(self, items):
+        now = time.time()
+        rows = [(key, _encode(vector), now) for key, vector in items]
+        with self._lock:
+            for key, blob, _ in rows:
+                previous = self._conn.execute("SELECT size FROM embeddings WHERE key = ?", (key,)).fetchone()
+                self._total_bytes += len(blob) - (previous[0] if previous else 0)
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, size, last_used) VALUES (?, ?, ?, ?)",
+                [(key, blob, len(blob), last_used) for key, blob, last_used in rows]
+            )
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        # Drop least recently used vectors until the cache is back under 90% of its budget
+        target = int(self.max_bytes * 0.9)
+        cursor = self._conn.execute("SELECT key, size FROM embeddings ORDER BY last_used")
+        evicted = []
+        for key, size in cursor:
+            if self._total_bytes <= target:
+                break
+            evicted.append((key,))
+            self._total_bytes -= size
+        self._conn.executemany("DELETE FROM embeddings WHERE key = ?", evicted)
+
+
+class CachedEmbeddings(Embeddings):
+    def __init__(self, embeddings, model_id, store=None):
+        self.embeddings = embeddings
+        self.model_id = model_id
+        self.store = store or get_embedding_cache_store()
+
+    def embed_documents(self, texts):
+        vectors = self.cached_vectors(texts)
+        missing = list(dict.fromkeys(text for text, vector in zip(texts, vectors) if vector is None))
+        if not missing:
+            return vectors
+
+        computed = dict(zip(missing, self.embeddings.embed_documents(missing)))
+        self.store_vectors(computed.keys(), computed.values())
+        return [computed[text] if vector is None else vector for text, vector in zip(texts, vectors)]
+
+    def cached_vectors(self, texts):
+        keys = [self._key(text) for text in texts]
+        cached = self.store.get_many(list(set(keys)))
+        return [cached.get(key) for key in keys]
+
+    def store_vectors(self, texts, vectors):
+        self.store.put_many([(self._key(text), vector) for text, vector in zip(texts, vectors)])
+
+    def embed_query(self, text):
+        key = self._key(text)
+        cached = self.store.get_many([key])
+        if key in cached:
+            return cached[key]
+
+        vector = self.embeddings.embed_query(text)
+        self.store.put_many([(key, vector)])
+        return vector
+
+    def _key(self, text):
+        return hashlib.sha256(f"{self.model_id}\0{text}".encode("utf-8")).hexdigest()
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_embedding_cache_store():
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = EmbeddingCacheStore()
+        return _store
+
+
+def _encode(vector):
+    return array("f", vector).tobytes()
+
+
+def _decode(blob):
+    vector = array("f")
+    vector.frombytes(blob)
+    return vector.tolist()
@@ -0,0 +1,95 @@
+import re
+from persistence.database import read_connection, write_transaction, get_recorded_queries, FLIGHT_COLUMNS
+
+_INDEXABLE_COLUMNS = FLIGHT_COLUMNS
+_COLUMN_PATTERN = "|".join(_INDEXABLE_COLUMNS)
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_EQUALITY_PREDICATE = re.compile(rf"\b({_COLUMN_PATTERN})\s*(?:==?|\bIS\b|\bIN\b)", re.IGNORECASE)
+_RANGE_PREDICATE = re.compile(rf"\b({_COLUMN_PATTERN})\s*(?:<=|>=|<|>|\bBETWEEN\b|\bLIKE\b)", re.IGNORECASE)
+_GROUP_OR_ORDER_BY = re.compile(r"\b(?:GROUP|ORDER)\s+BY\s+(.+?)(?=\bHAVING\b|\bORDER\b|\bLIMIT\b|\)|$)",
+                                re.IGNORECASE | re.DOTALL)
+
+
+def explain_query_plan(query):
+    with read_connection() as conn:
+        rows = conn.execute(f"EXPLAIN QUERY PLAN {query}").fetchall()
+
+    depth = {0: -1}
+    plan = []
+    for node_id, parent_id, _, detail in rows:
+        depth[node_id] = depth.get(parent_id, -1) + 1
+        plan.append((depth[node_id], detail))
+    return plan
+
+
+def suggest_indexes(query, plan=None):
+    plan = explain_query_plan(query) if plan is None else plan
+    details = [detail for _, detail in plan]
+    full_scan = any(re.match(r"SCAN flights\b(?!.*\bINDEX\b)", detail) for detail in details)
+    temp_btree = any(detail.startswith("USE TEMP B-TREE") for detail in details)
+    if not full_scan and not temp_btree:
+        return []
+
+    sql = _STRING_LITERAL.sub("?", query)
+    candidates = []
+    if full_scan:
+        equality = _unique(match.lower() for match in _EQUALITY_PREDICATE.findall(sql))
+        ranges = [column for column in _unique(match.lower() for match in _RANGE_PREDICATE.findall(sql))
+                  if column not in equality]
+        if re.search(r"\bOR\b", sql, re.IGNORECASE):
+            # OR terms are answered by separate single-column index lookups
+            candidates.extend((column,) for column in equality + ranges)
+        elif equality or ranges:
+            # Equality columns first, then at most one range column, as SQLite
+            # can only use the index up to the first inequality
+            candidates.append(tuple(equality + ranges[:1]))
+
+    for clause in _GROUP_OR_ORDER_BY.findall(sql):
+        columns = [term.strip().split()[0].lower() for term in clause.split(",") if term.strip()]
+        if columns and all(column in _INDEXABLE_COLUMNS for column in columns):
+            candidates.append(tuple(_unique(columns)))
+
+    existing = _existing_indexes()
+    suggestions = []
+    for columns in _unique(candidates):
+        if not any(index[:len(columns)] == columns for index in existing):
+            suggestions.append(columns)
+    return suggestions
+
+
+def advise_recorded_queries():
+    advice = {}
+    for query, runs in get_recorded_queries():
+        try:
+            suggestions = suggest_indexes(query)
+        except Exception:
+            continue
+        for columns in suggestions:
+            entry = advice.setdefault(columns, {"columns": columns, "statement": index_statement(columns),
+                                                "queries": 0, "runs": 0})
+            entry["queries"] += 1
+            entry["runs"] += runs
+    return sorted(advice.values(), key=lambda entry: entry["runs"], reverse=True)
+
+
+def index_statement(columns):
+    return f"CREATE INDEX IF NOT EXISTS idx_flights_{'_'.join(columns)} ON flights({', '.join(columns)})"
+
+
+def create_index(columns):
+    if not columns or any(column not in _INDEXABLE_COLUMNS for column in columns):
+        raise ValueError(f"Cannot index columns {columns}")
+    with write_transaction() as conn:
+        conn.execute(index_statement(columns))
+
+
+def _existing_indexes():
+    with read_connection() as conn:
+        names = [row[1] for row in conn.execute("PRAGMA index_list(flights)").fetchall()]
+        return [tuple(row[2] for row in sorted(conn.execute(f"PRAGMA index_info('{name}')").fetchall()))
+                for name in names]
+
+
+def _unique(items):
+    return list(dict.fromkeys(items))
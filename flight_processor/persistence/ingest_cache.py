@@ -0,0 +1,77 @@
+import hashlib
+import json
+from persistence.database import read_connection, write_transaction
+
+# SQLite caps bound parameters per statement, so lookups are issued in slices
+_LOOKUP_CHUNK_SIZE = 500
+
+
+def content_hash(content):
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+    return content_hash_blocks([content])
+
+
+def content_hash_blocks(blocks):
+    # The digest content_hash gives the joined blocks, whitespace runs
+    # collapsed to one space, without ever holding more than one block
+    digest = hashlib.sha256()
+    separator = b""
+    tail = b""
+    for block in blocks:
+        data = tail + block
+        words = data.split()
+        # A word running up to the end of the block may continue in the next one
+        tail = words.pop() if words and not data[-1:].isspace() else b""
+        for word in words:
+            digest.update(separator + word)
+            separator = b" "
+    if tail:
+        digest.update(separator + tail)
+    return digest.hexdigest()
+
+
+def get_ingested_hashes(hashes):
+    hashes = list(hashes)
+    found = set()
+    with read_connection() as conn:
+        for start in range(0, len(hashes), _LOOKUP_CHUNK_SIZE):
+            chunk = hashes[start:start + _LOOKUP_CHUNK_SIZE]
+            cursor = conn.execute(
+                f"SELECT content_hash FROM ingested_files WHERE content_hash IN ({', '.join('?' for _ in chunk)})",
+                chunk
+            )
+            found.update(row[0] for row in cursor.fetchall())
+    return found
+
+
+def mark_files_ingested(files):
+    with write_transaction() as conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO ingested_files (content_hash, file_name) VALUES (?, ?)",
+            files
+        )
+
+
+def get_cached_extractions(hashes, extractor):
+    hashes = list(hashes)
+    cached = {}
+    with read_connection() as conn:
+        for start in range(0, len(hashes), _LOOKUP_CHUNK_SIZE):
+            chunk = hashes[start:start + _LOOKUP_CHUNK_SIZE]
+            cursor = conn.execute(
+                f"SELECT content_hash, data FROM extraction_cache "
+                f"WHERE extractor = ? AND content_hash IN ({', '.join('?' for _ in chunk)})",
+                [extractor, *chunk]
+            )
+            cached.update((row[0], json.loads(row[1])) for row in cursor.fetchall())
+    return cached
+
+
+def store_extractions(entries, extractor):
+    with write_transaction() as conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO extraction_cache (content_hash, extractor, data) VALUES (?, ?, ?)",
+            [(digest, extractor, json.dumps({k: v for k, v in data.items() if k != "raw_data"}))
+             for digest, data in entries]
+        )
@@ -0,0 +1,89 @@
+import time
+import threading
+from contextlib import contextmanager
+from config import LLAMA_IDLE_UNLOAD_SECONDS
+
+
+class _ModelEntry:
+    def __init__(self):
+        self.model = None
+        self.load_lock = threading.Lock()
+        # llama.cpp contexts are not thread-safe, so each model serves one caller at a time
+        self.use_lock = threading.Lock()
+        self.in_use = 0
+        self.last_used = time.monotonic()
+
+
+class ModelRegistry:
+    def __init__(self, idle_timeout=LLAMA_IDLE_UNLOAD_SECONDS):
+        self.idle_timeout = idle_timeout
+        self._loaders = {}
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._reaper = None
+
+    def register(self, key, loader):
+        with self._lock:
+            self._loaders[key] = loader
+
+    def warm(self, *keys):
+        for key in keys:
+            entry = self._acquire(key)
+            self._release(entry)
+
+    def is_loaded(self, key):
+        entry = self._entries.get(key)
+        return entry is not None and entry.model is not None
+
+    @contextmanager
+    def use(self, key):
+        entry = self._acquire(key)
+        try:
+            with entry.use_lock:
+                yield entry.model
+        finally:
+            self._release(entry)
+
+    def unload_idle(self):
+        now = time.monotonic()
+        with self._lock:
+            for entry in self._entries.values():
+                if entry.model is not None and not entry.in_use and now - entry.last_used > self.idle_timeout:
+                    entry.model = None
+
+    def _acquire(self, key):
+        with self._lock:
+            if key not in self._loaders:
+                raise KeyError(f"No model registered under '{key}'")
+            entry = self._entries.setdefault(key, _ModelEntry())
+            entry.in_use += 1
+            self._start_reaper()
+
+        try:
+            with entry.load_lock:
+                if entry.model is None:
+                    entry.model = self._loaders[key]()
+        except Exception:
+            self._release(entry)
+            raise
+        return entry
+
+    def _release(self, entry):
+        with self._lock:
+            entry.in_use -= 1
+            entry.last_used = time.monotonic()
+
+    def _start_reaper(self):
+        if self._reaper is not None or not self.idle_timeout:
+            return
+
+        def reap():
+            while True:
+                time.sleep(min(self.idle_timeout, 60))
+                self.unload_idle()
+
+        self._reaper = threading.Thread(target=reap, name="model-registry-reaper", daemon=True)
+        self._reaper.start()
+
+
+model_registry = ModelRegistry()
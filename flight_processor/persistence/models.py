@@ -1,10 +1,55 @@
 import os
+import threading
 from langchain_community.chat_models import ChatOpenAI
 from langchain_community.llms import LlamaCpp
 from langchain_openai import OpenAIEmbeddings
 from langchain_community.embeddings import LlamaCppEmbeddings
+from langchain.llms.base import LLM
+from langchain.schema.embeddings import Embeddings
+from persistence.embedding_cache import CachedEmbeddings
+from persistence.model_registry import model_registry
+from services.embedding_engine import embed_with_llama
 
-from config import LLM_MODEL, LLM_TEMPERATURE, LLAMA_MODEL_PATH, LLAMA_MODEL_N_CTX
+from config import LLM_MODEL, LLM_TEMPERATURE, LLAMA_MODEL_PATH, LLAMA_MODEL_N_CTX, LLAMA_EMBED_N_BATCH, ANSWER_MAX_TOKENS
+
+LLAMA_LLM_KEY = "llama-llm"
+LLAMA_EMBEDDINGS_KEY = "llama-embeddings"
+# Vectors depend on the pooling and context settings as well as the weights,
+# so they are part of the embedding cache key
+LLAMA_EMBEDDINGS_MODEL_ID = (f"llama:{os.path.basename(LLAMA_MODEL_PATH)}:mean-pool"
+                             f":ctx{LLAMA_EMBED_N_BATCH}:batch{LLAMA_EMBED_N_BATCH}")
+
+model_registry.register(LLAMA_LLM_KEY, lambda: LlamaCpp(model_path=LLAMA_MODEL_PATH, n_ctx=LLAMA_MODEL_N_CTX,
+                                                         max_tokens=ANSWER_MAX_TOKENS))
+model_registry.register(LLAMA_EMBEDDINGS_KEY, lambda: LlamaCppEmbeddings(
+    model_path=LLAMA_MODEL_PATH, n_ctx=LLAMA_EMBED_N_BATCH, n_batch=LLAMA_EMBED_N_BATCH
+))
+
+
+class PooledLlamaCpp(LLM):
+    @property
+    def _llm_type(self):
+        return "pooled_llamacpp"
+
+    def _call(self, prompt, stop=None, run_manager=None, **kwargs):
+        with model_registry.use(LLAMA_LLM_KEY) as llm:
+            return llm.invoke(prompt, stop=stop, **kwargs)
+
+    def get_num_tokens(self, text):
+        # Counted with the model's own tokenizer, so context budgets are exact
+        with model_registry.use(LLAMA_LLM_KEY) as llm:
+            return llm.get_num_tokens(text)
+
+
+class PooledLlamaCppEmbeddings(Embeddings):
+    def embed_documents(self, texts):
+        with model_registry.use(LLAMA_EMBEDDINGS_KEY) as embeddings:
+            return embed_with_llama(embeddings.client, texts)
+
+    def embed_query(self, text):
+        # Same path as documents, so queries land in the same vector space
+        with model_registry.use(LLAMA_EMBEDDINGS_KEY) as embeddings:
+            return embed_with_llama(embeddings.client, [text])[0]
 
 
 class ModelFactory:
@@ -18,7 +63,8 @@ class ModelFactory:
             return ChatOpenAI(model=LLM_MODEL, temperature=LLM_TEMPERATURE)
         else:
             try:
-                return LlamaCpp(model_path=LLAMA_MODEL_PATH, n_ctx=LLAMA_MODEL_N_CTX)
+                model_registry.warm(LLAMA_LLM_KEY)
+                return PooledLlamaCpp()
             except Exception:
                 return None
 
@@ -29,26 +75,39 @@ class ModelFactory:
                 return None
 
             os.environ["OPENAI_API_KEY"] = api_key
-            return OpenAIEmbeddings()
+            embeddings = OpenAIEmbeddings()
+            return CachedEmbeddings(embeddings, f"openai:{embeddings.model}")
         else:
             try:
-                return LlamaCppEmbeddings(model_path=LLAMA_MODEL_PATH)
+                model_registry.warm(LLAMA_EMBEDDINGS_KEY)
+                return CachedEmbeddings(PooledLlamaCppEmbeddings(), LLAMA_EMBEDDINGS_MODEL_ID)
             except Exception:
                 return None
 
+    @staticmethod
+    def warm_llama_models():
+        def warm():
+            for key in (LLAMA_LLM_KEY, LLAMA_EMBEDDINGS_KEY):
+                try:
+                    model_registry.warm(key)
+                except Exception:
+                    pass
+
+        threading.Thread(target=warm, name="llama-warmup", daemon=True).start()
+
 
-def generate_answer(llm, query, flight_data):
+ANSWER_PROMPT = (
+    "Based on the following flight data, answer this question: {query}\n\n"
+    "Flight data:\n{flight_data}\n\n"
+    "If you can't answer based on the data, say \"I don't have enough information about that.\""
+)
+
+
+def generate_answer(llm, query, flight_context):
     if not llm:
         return "Error: LLM model could not be initialized"
 
-    flight_table = "\n".join([
-        f"{row[0]} {row[1]} on {row[2]}: from {row[3]} ({row[4]}) to {row[5]} ({row[6]})"
-        for row in flight_data
-    ])
-
-    prompt = "Based on the following flight data, answer this question: " + query + "\n\n"
-    prompt += "Flight data:\n" + flight_table + "\n\n"
-    prompt += "If you can't answer based on the data, say \"I don't have enough information about that.\""
+    prompt = ANSWER_PROMPT.format(query=query, flight_data=flight_context)
 
     try:
         if hasattr(llm, 'invoke'):
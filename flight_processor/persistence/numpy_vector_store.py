@@ -0,0 +1,485 @@
+import os
+import re
+import json
+import time
+import threading
+import numpy as np
+from langchain.schema import Document
+from langchain_core.vectorstores import VectorStore
+from config import NUMPY_SEARCH_BLOCK_ROWS, NUMPY_RERANK_FACTOR, VECTOR_VERSION_GRACE_SECONDS
+
+# One fixed-width record per stored vector. The metadata fields the search tab
+# filters on are kept as columns, so filters become boolean masks over them;
+# the full text and metadata sit in texts.bin and are only read for hits.
+ROW_DTYPE = np.dtype([
+    ("id", "i8"),
+    ("live", "?"),
+    ("norm", "f4"),
+    ("origin_date", "i4"),
+    ("airline", "S8"),
+    ("flight_number", "S8"),
+    ("departure_port", "S4"),
+    ("arrival_port", "S4"),
+    ("text_offset", "i8"),
+    ("text_length", "i4"),
+])
+FILTER_FIELDS = ("airline", "flight_number", "departure_port", "arrival_port", "origin_date")
+
+_INFO_FILE = "store.json"
+_FILE_KINDS = ("rows", "vectors", "texts", "codes")
+# Files only ever appended to or replaced whole, so bytes a reader already
+# references never change; the rows file is not, as deletes clear live flags in place
+APPEND_ONLY_FILE = re.compile(r"^(?:vectors|texts|codes)\.\d+\.\w+$")
+QUANTIZATIONS = ("int8", "binary")
+
+# Set bits per byte value, for Hamming distances between binary codes
+_POPCOUNT = np.array([bin(value).count("1") for value in range(256)], dtype=np.uint8)
+
+
+# A flat float32 matrix on disk, memory-mapped for search. Ids must be integers
+# (flight ids). Writes only append: an updated or deleted document leaves a dead
+# row behind until compact() rewrites the live rows as a new file generation.
+# With a quantization, searches scan compact int8 or binary codes first and
+# re-rank only the best candidates against the float32 vectors on disk.
+class NumpyVectorStore(VectorStore):
+    def __init__(self, persist_directory, embedding_function, quantization=None):
+        if quantization not in (None,) + QUANTIZATIONS:
+            raise ValueError(f"Unknown quantization '{quantization}'")
+        self.persist_directory = persist_directory
+        self.quantization = quantization
+        self._embedding = embedding_function
+        self._lock = threading.RLock()
+        self._info = {"dim": None, "generation": 0}
+        self._info_mtime = None
+        self._rows = None
+        self._vectors = None
+        self._codes = None
+        self._row_count = -1
+        self._id_rows = None
+        self._id_rows_count = 0
+        os.makedirs(persist_directory, exist_ok=True)
+
+    @property
+    def embeddings(self):
+        return self._embedding
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, ids=None, persist_directory=None, **kwargs):
+        store = cls(persist_directory, embedding)
+        store.add_texts(texts, metadatas, ids=ids)
+        return store
+
+    def add_texts(self, texts, metadatas=None, ids=None, **kwargs):
+        texts = list(texts)
+        metadatas = list(metadatas) if metadatas is not None else [{} for _ in texts]
+        vectors = np.asarray(self._embedding.embed_documents(texts), dtype=np.float32)
+
+        with self._lock:
+            self._open()
+            if ids is None:
+                next_id = int(self._rows["id"].max()) + 1 if len(self._rows) else 1
+                ids = [str(next_id + offset) for offset in range(len(texts))]
+            if self._info["dim"] is None:
+                self._write_info(dim=vectors.shape[1])
+            elif vectors.shape[1] != self._info["dim"]:
+                raise ValueError(f"Expected {self._info['dim']}-dimensional embeddings, got {vectors.shape[1]}")
+            if self.quantization:
+                self._write_missing_codes()
+
+            self._mark_dead(ids)
+            records = np.zeros(len(texts), dtype=ROW_DTYPE)
+            records["id"] = [int(doc_id) for doc_id in ids]
+            records["live"] = True
+            records["norm"] = np.linalg.norm(vectors, axis=1)
+            for field in FILTER_FIELDS:
+                records[field] = [_column_value(field, metadata.get(field)) for metadata in metadatas]
+
+            # Texts, vectors and codes go first; the rows file decides how many
+            # rows exist, so a write cut short leaves at most unreferenced bytes behind
+            with open(self._file("texts"), "ab") as text_file:
+                offset = text_file.tell()
+                for index, (text, metadata) in enumerate(zip(texts, metadatas)):
+                    payload = json.dumps({"text": text, "metadata": metadata}).encode("utf-8")
+                    records["text_offset"][index] = offset
+                    records["text_length"][index] = len(payload)
+                    text_file.write(payload)
+                    offset += len(payload)
+            self._truncate_unreferenced()
+            with open(self._file("vectors"), "ab") as vector_file:
+                vector_file.write(vectors.tobytes())
+            if self.quantization:
+                with open(self._file("codes"), "ab") as code_file:
+                    code_file.write(encode_vectors(vectors, self.quantization).tobytes())
+            with open(self._file("rows"), "ab") as row_file:
+                row_file.write(records.tobytes())
+
+            id_rows = self._id_map()
+            for offset, doc_id in enumerate(records["id"].tolist()):
+                id_rows[doc_id] = self._row_count + offset
+            self._id_rows_count = self._row_count + len(records)
+            self._row_count = -1
+        return list(ids)
+
+    def delete(self, ids=None, **kwargs):
+        with self._lock:
+            self._open()
+            self._mark_dead(ids or [])
+        return True
+
+    def delete_collection(self):
+        with self._lock:
+            self._open()
+            paths = [path for generation in [self._info["generation"], *self._info.get("retired", {})]
+                     for path in self._generation_files(generation)] + [self._path(_INFO_FILE)]
+            self._reset({"dim": None, "generation": 0})
+            for path in paths:
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def get(self, limit=None, **kwargs):
+        with self._lock:
+            self._open()
+            live_ids = self._rows["id"][self._rows["live"]]
+        return {"ids": [str(doc_id) for doc_id in live_ids[:limit].tolist()]}
+
+    def dead_fraction(self):
+        with self._lock:
+            self._open()
+            return 1 - np.count_nonzero(self._rows["live"]) / len(self._rows) if len(self._rows) else 0.0
+
+    def compact(self, min_dead_fraction=0.0):
+        # Live rows are copied into the next file generation, which store.json
+        # then points at in one atomic replace. The old generation is kept for a
+        # grace period, so other instances still searching it can finish.
+        with self._lock:
+            self._open()
+            self._collect_retired()
+            if self.quantization:
+                self._write_missing_codes()
+            live = np.flatnonzero(self._rows["live"])
+            if len(live) == len(self._rows) or self.dead_fraction() <= min_dead_fraction:
+                return
+            generation = self._info["generation"] + 1
+
+            records = np.array(self._rows[live])
+            with open(self._file("texts"), "rb") as source, \
+                    open(self._file("texts", generation), "wb") as target:
+                offset = 0
+                for index in range(len(records)):
+                    source.seek(records["text_offset"][index])
+                    target.write(source.read(records["text_length"][index]))
+                    records["text_offset"][index] = offset
+                    offset += records["text_length"][index]
+            with open(self._file("vectors", generation), "wb") as target:
+                for start in range(0, len(live), NUMPY_SEARCH_BLOCK_ROWS):
+                    block = live[start:start + NUMPY_SEARCH_BLOCK_ROWS]
+                    target.write(np.ascontiguousarray(self._vectors[block]).tobytes())
+            if self.quantization:
+                with open(self._file("codes", generation), "wb") as target:
+                    for start in range(0, len(live), NUMPY_SEARCH_BLOCK_ROWS):
+                        block = live[start:start + NUMPY_SEARCH_BLOCK_ROWS]
+                        target.write(encode_vectors(self._vectors[block], self.quantization).tobytes())
+            with open(self._file("rows", generation), "wb") as target:
+                target.write(records.tobytes())
+
+            retired = {**self._info.get("retired", {}), str(self._info["generation"]): time.time()}
+            self._write_info(generation=generation, retired=retired)
+            self._reset(self._info)
+
+    def memory_usage(self):
+        # Bytes a full scan reads: the codes when quantized, otherwise the vectors
+        with self._lock:
+            self._open()
+            scanned = self._codes if self._codes is not None else self._vectors
+            return {"rows": len(self._rows), "scan_bytes": scanned.nbytes, "vector_bytes": self._vectors.nbytes}
+
+    def similarity_search(self, query, k=4, filter=None, **kwargs):
+        return self.similarity_search_by_vector(self._embedding.embed_query(query), k=k, filter=filter)
+
+    def similarity_search_by_vector(self, embedding, k=4, filter=None, **kwargs):
+        return [document for document, _ in
+                self.similarity_search_by_vector_with_relevance_scores(embedding, k=k, filter=filter)]
+
+    def similarity_search_by_vector_with_relevance_scores(self, embedding, k=4, filter=None, **kwargs):
+        # Scores are cosine distances, lower being closer, as Chroma reports them
+        with self._lock:
+            self._open()
+            rows, vectors, codes, texts_path = self._rows, self._vectors, self._codes, self._file("texts")
+        if not len(rows):
+            return []
+
+        query = np.asarray(embedding, dtype=np.float32)
+        mask = rows["live"] & (filter_mask(rows, filter) if filter else True)
+        candidates = np.flatnonzero(mask)
+        if not len(candidates):
+            return []
+
+        if len(candidates) < len(rows) // 4:
+            # Selective filters: gather just the matching rows from the map
+            best = _rerank(vectors, rows["norm"], candidates, query, k)
+        elif codes is not None:
+            best = quantized_search(vectors, rows["norm"], codes, self.quantization, query, k, mask=mask)
+        else:
+            best = exact_search(vectors, rows["norm"], query, k, mask=mask)
+        distances = 1 - _cosine(vectors[best], rows["norm"][best], query)
+        return list(zip(_read_documents(texts_path, rows[best]), distances.tolist()))
+
+    def _open(self):
+        # Picks up a compaction or appends by another writer since the last look
+        info_path = self._path(_INFO_FILE)
+        mtime = os.path.getmtime(info_path) if os.path.exists(info_path) else None
+        if mtime != self._info_mtime:
+            if mtime is not None:
+                with open(info_path) as info:
+                    self._reset(json.load(info))
+            self._info_mtime = mtime
+
+        rows_path = self._file("rows")
+        row_count = os.path.getsize(rows_path) // ROW_DTYPE.itemsize if os.path.exists(rows_path) else 0
+        if row_count == self._row_count:
+            return
+
+        if row_count:
+            self._rows = np.memmap(rows_path, dtype=ROW_DTYPE, mode="r+", shape=(row_count,))
+            self._vectors = np.memmap(self._file("vectors"), dtype=np.float32, mode="r",
+                                      shape=(row_count, self._info["dim"]))
+        else:
+            self._rows = np.zeros(0, dtype=ROW_DTYPE)
+            self._vectors = np.zeros((0, self._info["dim"] or 0), dtype=np.float32)
+        self._row_count = row_count
+        self._codes = self._map_codes() if self.quantization and row_count else None
+
+    def _map_codes(self):
+        # Searches only read codes; until every row has one (a store that was
+        # just switched to quantization, say) they scan the float32 vectors
+        code_dtype = _code_dtype(self.quantization, self._info["dim"])
+        if self._encoded_rows(code_dtype) < self._row_count:
+            return None
+        return np.memmap(self._file("codes"), dtype=code_dtype, mode="r", shape=(self._row_count,))
+
+    def _write_missing_codes(self):
+        # Writers encode every row into a staging file that replaces the codes
+        # whole, so no reader ever maps a file that is still being written
+        if not self._row_count:
+            return
+        code_dtype = _code_dtype(self.quantization, self._info["dim"])
+        if self._encoded_rows(code_dtype) >= self._row_count:
+            return
+        staging = self._file("codes") + ".tmp"
+        with open(staging, "wb") as code_file:
+            for start in range(0, self._row_count, NUMPY_SEARCH_BLOCK_ROWS):
+                block = self._vectors[start:start + NUMPY_SEARCH_BLOCK_ROWS]
+                code_file.write(encode_vectors(block, self.quantization).tobytes())
+        os.replace(staging, self._file("codes"))
+        self._codes = self._map_codes()
+
+    def _encoded_rows(self, code_dtype):
+        codes_path = self._file("codes")
+        return os.path.getsize(codes_path) // code_dtype.itemsize if os.path.exists(codes_path) else 0
+
+    def _collect_retired(self, grace_seconds=VECTOR_VERSION_GRACE_SECONDS):
+        now = time.time()
+        retired = self._info.get("retired", {})
+        expired = [generation for generation, retired_at in retired.items() if now - retired_at >= grace_seconds]
+        if not expired:
+            return
+        for generation in expired:
+            for path in self._generation_files(generation):
+                os.remove(path)
+        self._write_info(retired={generation: retired_at for generation, retired_at in retired.items()
+                                  if generation not in expired})
+
+    def _reset(self, info):
+        self._info = dict(info)
+        self._rows = self._vectors = self._codes = self._id_rows = None
+        self._row_count = -1
+
+    def _write_info(self, **changes):
+        info = {**self._info, **changes}
+        staging = self._path(_INFO_FILE + ".tmp")
+        with open(staging, "w") as info_file:
+            json.dump(info, info_file)
+        os.replace(staging, self._path(_INFO_FILE))
+        self._info = info
+        self._info_mtime = os.path.getmtime(self._path(_INFO_FILE))
+
+    def _id_map(self):
+        # Only writers need the id lookup, so searches never pay for building it
+        if self._id_rows is None or self._id_rows_count != self._row_count:
+            live = np.flatnonzero(self._rows["live"])
+            self._id_rows = dict(zip(self._rows["id"][live].tolist(), live.tolist()))
+            self._id_rows_count = self._row_count
+        return self._id_rows
+
+    def _mark_dead(self, ids):
+        id_rows = self._id_map()
+        rows = [id_rows.pop(int(doc_id)) for doc_id in ids if int(doc_id) in id_rows]
+        if rows:
+            self._rows["live"][rows] = False
+            self._rows.flush()
+
+    def _truncate_unreferenced(self):
+        # Drop vectors and codes a cut-short write left without a row
+        sizes = {"vectors": self._info["dim"] * 4}
+        if self.quantization:
+            sizes["codes"] = _code_dtype(self.quantization, self._info["dim"]).itemsize
+        for kind, row_size in sizes.items():
+            path = self._file(kind)
+            if os.path.exists(path) and os.path.getsize(path) > self._row_count * row_size:
+                with open(path, "r+b") as data_file:
+                    data_file.truncate(self._row_count * row_size)
+
+    def _file(self, kind, generation=None):
+        generation = self._info["generation"] if generation is None else generation
+        extension = self.quantization if kind == "codes" else _EXTENSIONS[kind]
+        return self._path(f"{kind}.{generation}.{extension}")
+
+    def _generation_files(self, generation):
+        names = (name.split(".") for name in os.listdir(self.persist_directory))
+        return [self._path(".".join(parts)) for parts in names
+                if len(parts) == 3 and parts[0] in _FILE_KINDS and parts[1] == str(generation)]
+
+    def _path(self, name):
+        return os.path.join(self.persist_directory, name)
+
+
+_EXTENSIONS = {"rows": "bin", "vectors": "f32", "texts": "bin"}
+
+
+def _read_documents(texts_path, records):
+    documents = []
+    with open(texts_path, "rb") as text_file:
+        for offset, length in zip(records["text_offset"].tolist(), records["text_length"].tolist()):
+            text_file.seek(offset)
+            payload = json.loads(text_file.read(length))
+            documents.append(Document(page_content=payload["text"], metadata=payload["metadata"]))
+    return documents
+
+
+def filter_mask(rows, where):
+    # Chroma-style where clauses: {"field": value}, {"field": {"$op": value}},
+    # {"$and": [...]} and {"$or": [...]}
+    mask = np.ones(len(rows), dtype=bool)
+    for key, condition in where.items():
+        if key == "$and":
+            for clause in condition:
+                mask &= filter_mask(rows, clause)
+        elif key == "$or":
+            mask &= np.logical_or.reduce([filter_mask(rows, clause) for clause in condition])
+        elif key in FILTER_FIELDS:
+            operations = condition if isinstance(condition, dict) else {"$eq": condition}
+            for operation, value in operations.items():
+                mask &= _compare(rows[key], key, operation, value)
+        else:
+            raise ValueError(f"Cannot filter on '{key}'")
+    return mask
+
+
+def _compare(column, field, operation, value):
+    if operation == "$in":
+        return np.isin(column, [_column_value(field, item) for item in value])
+    if operation == "$nin":
+        return ~np.isin(column, [_column_value(field, item) for item in value])
+
+    value = _column_value(field, value)
+    comparisons = {
+        "$eq": np.equal, "$ne": np.not_equal, "$gt": np.greater, "$gte": np.greater_equal,
+        "$lt": np.less, "$lte": np.less_equal,
+    }
+    if operation not in comparisons:
+        raise ValueError(f"Unsupported filter operator '{operation}'")
+    present = column != _column_value(field, None)
+    return comparisons[operation](column, value) & present
+
+
+def _column_value(field, value):
+    if field == "origin_date":
+        return int(value) if value is not None else 0
+    return str(value).encode("ascii", "replace") if value is not None else b""
+
+
+def _cosine(vectors, norms, query):
+    return (vectors @ query) / (norms * np.linalg.norm(query) + 1e-12)
+
+
+def _rerank(vectors, norms, candidates, query, k):
+    scores = _cosine(vectors[candidates], norms[candidates], query)
+    return candidates[_top_indices(scores, k)]
+
+
+def _code_dtype(quantization, dim):
+    if quantization == "int8":
+        # Per-row scale back from int8 to the unit vector's components
+        return np.dtype([("scale", "f4"), ("code", "i1", (dim,))])
+    return np.dtype([("code", "u1", ((dim + 7) // 8,))])
+
+
+def encode_vectors(vectors, quantization):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    codes = np.zeros(len(vectors), dtype=_code_dtype(quantization, vectors.shape[1]))
+    if quantization == "int8":
+        units = vectors / (np.linalg.norm(vectors, axis=1, keepdims=True) + 1e-12)
+        peaks = np.abs(units).max(axis=1, keepdims=True) + 1e-12
+        codes["code"] = np.rint(units / peaks * 127)
+        codes["scale"] = peaks[:, 0] / 127
+    else:
+        codes["code"] = np.packbits(vectors > 0, axis=1)
+    return codes
+
+
+def exact_search(vectors, norms, query, k, mask=None):
+    # Row indices of the k vectors closest to the query, best first
+    mask = np.ones(len(vectors), dtype=bool) if mask is None else mask
+
+    def score_block(start, stop):
+        return _cosine(vectors[start:stop], norms[start:stop], query)
+    return _blocked_top_k(len(vectors), score_block, mask, k)
+
+
+def quantized_search(vectors, norms, codes, quantization, query, k, rerank_factor=NUMPY_RERANK_FACTOR, mask=None):
+    # Scans the codes for k * rerank_factor candidates and re-ranks those
+    # against the float32 vectors, as the store's searches do
+    mask = np.ones(len(vectors), dtype=bool) if mask is None else mask
+    candidates = _blocked_top_k(len(vectors), _code_scorer(codes, quantization, query), mask, k * rerank_factor)
+    return _rerank(vectors, norms, np.sort(candidates), query, k)
+
+
+def _code_scorer(codes, quantization, query):
+    # Approximate scores that rank like cosine similarity: dot products with the
+    # dequantized unit vectors, or fewest differing sign bits
+    if quantization == "int8":
+        unit = query / (np.linalg.norm(query) + 1e-12)
+
+        def score_block(start, stop):
+            block = codes[start:stop]
+            return (block["code"] @ unit) * block["scale"]
+    else:
+        query_bits = encode_vectors(query[None, :], quantization)["code"][0]
+
+        def score_block(start, stop):
+            differing = _POPCOUNT[np.bitwise_xor(codes["code"][start:stop], query_bits)]
+            return -differing.sum(axis=1, dtype=np.float32)
+    return score_block
+
+
+def _top_indices(scores, k):
+    k = min(k, len(scores))
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top])]
+
+
+def _blocked_top_k(row_count, score_block, mask, k):
+    # Scores the map a block at a time, so only one block is resident per
+    # step, keeping the best k seen so far
+    best_rows = np.zeros(0, dtype=np.int64)
+    best_scores = np.zeros(0, dtype=np.float32)
+    for start in range(0, row_count, NUMPY_SEARCH_BLOCK_ROWS):
+        stop = start + NUMPY_SEARCH_BLOCK_ROWS
+        scores = np.asarray(score_block(start, stop), dtype=np.float32)
+        scores[~mask[start:stop]] = -np.inf
+        top = _top_indices(scores, k)
+        best_rows = np.concatenate([best_rows, top + start])
+        best_scores = np.concatenate([best_scores, scores[top]])
+        keep = _top_indices(best_scores, k)
+        best_rows, best_scores = best_rows[keep], best_scores[keep]
+    return best_rows[np.isfinite(best_scores)]
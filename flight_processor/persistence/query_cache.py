@@ -0,0 +1,80 @@
+import re
+import sys
+import threading
+from collections import OrderedDict
+from config import QUERY_CACHE_MAX_BYTES
+
+_QUOTED = re.compile(r"""('(?:[^']|'')*'|"(?:[^"]|"")*")""")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_sql(query):
+    # Collapse whitespace outside quoted literals only, so 'a  b' and 'a b' stay distinct
+    parts = _QUOTED.split(query.strip().rstrip(";").strip())
+    return "".join(part if index % 2 else _WHITESPACE.sub(" ", part) for index, part in enumerate(parts))
+
+
+class QueryResultCache:
+    def __init__(self, max_bytes=QUERY_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.data_version = 0
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._lock = threading.Lock()
+
+    def get_or_load(self, key, loader):
+        with self._lock:
+            version = self.data_version
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return entry[0]
+            self._misses += 1
+
+        result = loader()
+        size = _result_size(result)
+        with self._lock:
+            # A write that landed while we were reading makes this result stale
+            if version == self.data_version and size <= self.max_bytes:
+                previous = self._entries.pop(key, None)
+                if previous is not None:
+                    self._total_bytes -= previous[1]
+                self._entries[key] = (result, size)
+                self._total_bytes += size
+                while self._total_bytes > self.max_bytes:
+                    _, (_, evicted_size) = self._entries.popitem(last=False)
+                    self._total_bytes -= evicted_size
+        return result
+
+    def invalidate(self):
+        with self._lock:
+            self.data_version += 1
+            self._entries.clear()
+            self._total_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": self._hits / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+                "data_version": self.data_version,
+            }
+
+
+def _result_size(value):
+    # Rough deep size of the nested tuples, lists, dicts and scalars a result holds
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(_result_size(item) for item in value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(_result_size(key) + _result_size(item) for key, item in value.items())
+    return sys.getsizeof(value)
+
+
+query_cache = QueryResultCache()
@@ -0,0 +1,228 @@
+import os
+import uuid
+import shutil
+import sqlite3
+import threading
+from collections import OrderedDict
+from langchain_core.vectorstores import VectorStore
+from config import VECTOR_SHARD_CACHE_SIZE
+
+_SHARD_DIR = "shards"
+_SHARD_INDEX_FILE = "shard_index.db"
+_UNDATED = "undated"
+
+
+# One store per origin date (the YYYYMMDD origin_date metadata), each opened
+# lazily by open_shard(path, embeddings) with at most cache_size kept loaded.
+# Queries filtered on origin_date only open the shards inside the range, and a
+# past day is dropped by deleting its directory.
+class DateShardedVectorStore(VectorStore):
+    def __init__(self, persist_directory, embedding_function, open_shard, cache_size=VECTOR_SHARD_CACHE_SIZE):
+        self.persist_directory = persist_directory
+        self._embedding = embedding_function
+        self._open_shard = open_shard
+        self._cache_size = cache_size
+        self._loaded = OrderedDict()
+        self._written = set()
+        self._lock = threading.RLock()
+        os.makedirs(os.path.join(persist_directory, _SHARD_DIR), exist_ok=True)
+
+        # Which shard holds each document, so updates and deletes open only that one
+        self._index = sqlite3.connect(os.path.join(persist_directory, _SHARD_INDEX_FILE), check_same_thread=False)
+        self._index.execute("CREATE TABLE IF NOT EXISTS document_shards (id TEXT PRIMARY KEY, shard TEXT NOT NULL)")
+        self._index.execute("CREATE INDEX IF NOT EXISTS document_shards_shard ON document_shards (shard)")
+        self._index.commit()
+
+    @property
+    def embeddings(self):
+        return self._embedding
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, ids=None, persist_directory=None, open_shard=None, **kwargs):
+        store = cls(persist_directory, embedding, open_shard)
+        store.add_texts(texts, metadatas, ids=ids)
+        return store
+
+    def add_texts(self, texts, metadatas=None, ids=None, **kwargs):
+        texts = list(texts)
+        metadatas = list(metadatas) if metadatas is not None else [{} for _ in texts]
+        ids = list(ids) if ids is not None else [str(uuid.uuid4()) for _ in texts]
+
+        targets = {}
+        groups = {}
+        for text, metadata, doc_id in zip(texts, metadatas, ids):
+            targets[str(doc_id)] = shard = _shard_key(metadata)
+            group = groups.setdefault(shard, ([], [], []))
+            for values, value in zip(group, (text, metadata, doc_id)):
+                values.append(value)
+
+        with self._lock:
+            # A document whose date changed leaves its old shard first
+            self._delete_from_shards([(doc_id, shard) for doc_id, shard in self._shards_of(ids)
+                                      if targets[doc_id] != shard])
+
+            for shard, (shard_texts, shard_metadatas, shard_ids) in groups.items():
+                self._shard(shard).add_texts(shard_texts, shard_metadatas, ids=shard_ids)
+                self._index.executemany("INSERT OR REPLACE INTO document_shards (id, shard) VALUES (?, ?)",
+                                        [(doc_id, shard) for doc_id in shard_ids])
+                self._written.add(shard)
+            self._index.commit()
+        return ids
+
+    def delete(self, ids=None, **kwargs):
+        with self._lock:
+            self._delete_from_shards(self._shards_of(ids or []))
+            self._index.commit()
+        return True
+
+    def delete_collection(self):
+        with self._lock:
+            while self._loaded:
+                _close_shard(self._loaded.popitem()[1])
+            self._written.clear()
+            shutil.rmtree(os.path.join(self.persist_directory, _SHARD_DIR), ignore_errors=True)
+            os.makedirs(os.path.join(self.persist_directory, _SHARD_DIR), exist_ok=True)
+            self._index.execute("DELETE FROM document_shards")
+            self._index.commit()
+
+    def get(self, limit=None, **kwargs):
+        with self._lock:
+            rows = self._index.execute("SELECT id FROM document_shards LIMIT ?",
+                                       (-1 if limit is None else limit,)).fetchall()
+        return {"ids": [row[0] for row in rows]}
+
+    def drop_dates_before(self, cutoff):
+        # Removes whole days older than the YYYYMMDD cutoff without opening them,
+        # returning the ids that went with them
+        with self._lock:
+            dropped = []
+            for shard in self.shard_keys():
+                if shard == _UNDATED or int(shard) >= cutoff:
+                    continue
+                _close_shard(self._loaded.pop(shard, None))
+                self._written.discard(shard)
+                shutil.rmtree(self._shard_path(shard), ignore_errors=True)
+                dropped.extend(row[0] for row in self._index.execute(
+                    "SELECT id FROM document_shards WHERE shard = ?", (shard,)))
+                self._index.execute("DELETE FROM document_shards WHERE shard = ?", (shard,))
+            self._index.commit()
+            return dropped
+
+    def compact(self, min_dead_fraction=0.0):
+        with self._lock:
+            for shard in sorted(self._written):
+                store = self._shard(shard)
+                if hasattr(store, "compact"):
+                    store.compact(min_dead_fraction=min_dead_fraction)
+            self._written.clear()
+
+    def shard_keys(self):
+        return sorted(os.listdir(os.path.join(self.persist_directory, _SHARD_DIR)))
+
+    def loaded_shards(self):
+        with self._lock:
+            return list(self._loaded)
+
+    def similarity_search(self, query, k=4, filter=None, **kwargs):
+        return self.similarity_search_by_vector(self._embedding.embed_query(query), k=k, filter=filter)
+
+    def similarity_search_by_vector(self, embedding, k=4, filter=None, **kwargs):
+        return [document for document, _ in
+                self.similarity_search_by_vector_with_relevance_scores(embedding, k=k, filter=filter)]
+
+    def similarity_search_by_vector_with_relevance_scores(self, embedding, k=4, filter=None, **kwargs):
+        # Every shard returns its own best k as distances, merged into one ranking
+        low, high = _date_bounds(filter) if filter else (None, None)
+        results = []
+        with self._lock:
+            for shard in self.shard_keys():
+                if low is not None or high is not None:
+                    if shard == _UNDATED or not (low or 0) <= int(shard) <= (high or 99999999):
+                        continue
+                results.extend(self._shard(shard).similarity_search_by_vector_with_relevance_scores(
+                    embedding, k=k, filter=filter))
+        results.sort(key=lambda result: result[1])
+        return results[:k]
+
+    def _shard(self, shard):
+        store = self._loaded.get(shard)
+        if store is not None:
+            self._loaded.move_to_end(shard)
+            return store
+
+        store = self._open_shard(self._shard_path(shard), self._embedding)
+        self._loaded[shard] = store
+        while len(self._loaded) > self._cache_size:
+            # Shards are only used under the lock, so an evicted one is idle
+            _close_shard(self._loaded.popitem(last=False)[1])
+        return store
+
+    def _shard_path(self, shard):
+        return os.path.join(self.persist_directory, _SHARD_DIR, shard)
+
+    def _shards_of(self, ids):
+        ids = [str(doc_id) for doc_id in ids]
+        found = []
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            found.extend(self._index.execute(
+                f"SELECT id, shard FROM document_shards WHERE id IN ({', '.join('?' for _ in chunk)})", chunk))
+        return found
+
+    def _delete_from_shards(self, placements):
+        by_shard = {}
+        for doc_id, shard in placements:
+            by_shard.setdefault(shard, []).append(doc_id)
+        for shard, shard_ids in by_shard.items():
+            if os.path.isdir(self._shard_path(shard)):
+                self._shard(shard).delete(ids=shard_ids)
+                self._written.add(shard)
+            self._index.executemany("DELETE FROM document_shards WHERE id = ?", [(doc_id,) for doc_id in shard_ids])
+
+
+def _close_shard(store):
+    # chromadb keeps the system behind a persist directory running until its
+    # last client closes, so an evicted Chroma shard is closed to free it.
+    # NumPy shards hold only memory maps, released with the store itself.
+    client = getattr(store, "_client", None)
+    if hasattr(client, "close"):
+        client.close()
+
+
+def _shard_key(metadata):
+    origin_date = metadata.get("origin_date")
+    return str(int(origin_date)) if origin_date else _UNDATED
+
+
+def _date_bounds(where):
+    # The origin_date range a Chroma-style where clause confines results to;
+    # $or branches are not narrowed, so they search every shard
+    low = high = None
+    clauses = list(where.get("$and", [])) + [{key: value} for key, value in where.items() if key != "$and"]
+    for clause in clauses:
+        if "$and" in clause:
+            bounds = [_date_bounds(clause)]
+        elif "origin_date" in clause:
+            condition = clause["origin_date"]
+            operations = condition if isinstance(condition, dict) else {"$eq": condition}
+            bounds = [_operation_bounds(operation, value) for operation, value in operations.items()]
+        else:
+            continue
+        for clause_low, clause_high in bounds:
+            if clause_low is not None:
+                low = clause_low if low is None else max(low, clause_low)
+            if clause_high is not None:
+                high = clause_high if high is None else min(high, clause_high)
+    return low, high
+
+
+def _operation_bounds(operation, value):
+    if operation == "$eq":
+        return int(value), int(value)
+    if operation == "$in" and value:
+        return min(int(item) for item in value), max(int(item) for item in value)
+    if operation in ("$gt", "$gte"):
+        return int(value), None
+    if operation in ("$lt", "$lte"):
+        return None, int(value)
+    return None, None
@@ -0,0 +1,168 @@
+import os
+import json
+import time
+import shutil
+import threading
+from contextlib import contextmanager
+from chromadb.api.client import SharedSystemClient
+from persistence.numpy_vector_store import APPEND_ONLY_FILE
+from config import VECTOR_MANIFEST_FILE, VECTOR_VERSION_GRACE_SECONDS
+
+# Each store root holds complete versions under versions/, and CURRENT.json
+# names the one searches use. A build fills a new version and then replaces
+# CURRENT.json in one os.replace, so readers see either the old store or the
+# new one, never a half-built one. Versions that stop being current are kept
+# for a grace period so searches still holding them can finish.
+_VERSIONS_DIR = "versions"
+_POINTER_FILE = "CURRENT.json"
+
+_lock = threading.Lock()
+# One build at a time, so a staged version is never shared by two builders
+_build_lock = threading.Lock()
+
+
+def current_version_path(root):
+    version = _read_pointer(root).get("version")
+    return os.path.join(root, _VERSIONS_DIR, version) if version else None
+
+
+@contextmanager
+def staged_version(root):
+    # Yields the directory to build the next version in, published as current
+    # only if the build finishes without raising
+    with _build_lock:
+        path = _stage(root)
+        yield path
+        with _lock:
+            pointer = _read_pointer(root)
+            _retire(pointer, pointer.get("version"))
+            pointer["version"] = pointer.pop("staging")
+            _write_pointer(root, pointer)
+    collect_retired_versions(root)
+
+
+def _stage(root):
+    with _lock:
+        _migrate_unversioned(root)
+        pointer = _read_pointer(root)
+        if pointer.get("staging"):
+            # A build that was interrupted left its manifest committed per
+            # batch, so the next build carries on from it
+            return os.path.join(root, _VERSIONS_DIR, pointer["staging"])
+
+        versions_dir = os.path.join(root, _VERSIONS_DIR)
+        os.makedirs(versions_dir, exist_ok=True)
+        known = {pointer.get("version"), *pointer.get("retired", {})}
+        for name in os.listdir(versions_dir):
+            if name not in known:
+                # A copy cut short before it was recorded as staging
+                shutil.rmtree(os.path.join(versions_dir, name), ignore_errors=True)
+
+        # Numbers are never reused, since clients may cache a store by its path
+        pointer["last"] = pointer.get("last", 0) + 1
+        pointer["staging"] = version = f"v{pointer['last']:06d}"
+        path = os.path.join(versions_dir, version)
+        current = current_version_path(root)
+
+        # A copy of the current version, so an incremental build only applies
+        # its changes instead of re-embedding everything. Chroma rewrites its
+        # SQLite file and HNSW segments in place, so nothing of a Chroma store
+        # can be shared and every build copies all of it: embedding stays
+        # incremental, but staging costs O(store size). The NumPy backend
+        # shares its bulk files and copies only rows and metadata.
+        if current and os.path.isdir(current):
+            shutil.copytree(current, path, copy_function=_link_or_copy)
+        else:
+            os.makedirs(path)
+        _write_pointer(root, pointer)
+    return path
+
+
+def retire_all_versions(root):
+    # Nothing is current afterwards; the files go once the grace period is over
+    with _build_lock, _lock:
+        pointer = _read_pointer(root)
+        for version in (pointer.pop("version", None), pointer.pop("staging", None)):
+            _retire(pointer, version)
+        _write_pointer(root, pointer)
+    collect_retired_versions(root)
+
+
+def collect_retired_versions(root, grace_seconds=VECTOR_VERSION_GRACE_SECONDS):
+    now = time.time()
+    with _lock:
+        pointer = _read_pointer(root)
+        retired = pointer.get("retired", {})
+        expired = [version for version, retired_at in retired.items() if now - retired_at >= grace_seconds]
+        for version in expired:
+            _release_client(os.path.join(root, _VERSIONS_DIR, version))
+            shutil.rmtree(os.path.join(root, _VERSIONS_DIR, version), ignore_errors=True)
+            # A directory still locked by a reader is retried on the next pass
+            if not os.path.exists(os.path.join(root, _VERSIONS_DIR, version)):
+                del retired[version]
+        if expired:
+            _write_pointer(root, pointer)
+
+
+def _link_or_copy(source, target):
+    # Append-only NumPy files are shared with the live version by hard link,
+    # as a build only adds bytes the live rows never point at. SQLite files,
+    # Chroma's index and NumPy row flags change in place, so they are copied.
+    if APPEND_ONLY_FILE.match(os.path.basename(source)):
+        try:
+            os.link(source, target)
+            return target
+        except OSError:
+            pass
+    return shutil.copy2(source, target)
+
+
+def _release_client(path):
+    # chromadb keeps the system it opened for a persist directory until the
+    # process exits; a removed version's is stopped so its handles go with it.
+    # The registry is private to chromadb, so a release without it is skipped
+    # and the system lives on until the process exits, as it did before.
+    systems = getattr(SharedSystemClient, "_identifier_to_system", None)
+    if not isinstance(systems, dict):
+        return
+    system = systems.pop(path, None)
+    refcounts = getattr(SharedSystemClient, "_identifier_to_refcount", None)
+    if isinstance(refcounts, dict):
+        refcounts.pop(path, None)
+    if system is not None:
+        system.stop()
+
+
+def _retire(pointer, version):
+    if version:
+        pointer.setdefault("retired", {})[version] = time.time()
+
+
+def _migrate_unversioned(root):
+    # Stores written before versioning sit directly in the root; they become
+    # the first version by renaming, so nothing is copied or re-embedded
+    if os.path.exists(os.path.join(root, _POINTER_FILE)) or \
+            not os.path.exists(os.path.join(root, VECTOR_MANIFEST_FILE)):
+        return
+    path = os.path.join(root, _VERSIONS_DIR, "v000001")
+    os.makedirs(path)
+    for name in os.listdir(root):
+        if name not in (_VERSIONS_DIR, "numpy", "by_date"):
+            os.rename(os.path.join(root, name), os.path.join(path, name))
+    _write_pointer(root, {"version": "v000001", "last": 1})
+
+
+def _read_pointer(root):
+    try:
+        with open(os.path.join(root, _POINTER_FILE)) as pointer_file:
+            return json.load(pointer_file)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_pointer(root, pointer):
+    os.makedirs(root, exist_ok=True)
+    staging = os.path.join(root, _POINTER_FILE + ".tmp")
+    with open(staging, "w") as pointer_file:
+        json.dump(pointer, pointer_file)
+    os.replace(staging, os.path.join(root, _POINTER_FILE))
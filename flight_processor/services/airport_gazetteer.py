@@ -0,0 +1,151 @@
+import re
+import sys
+import csv
+import gzip
+import threading
+import unicodedata
+from config import AIRPORT_DATA_PATH
+
+# Names the bundled data spells differently from how our schedules refer to them
+CITY_OVERRIDES = {
+    "CNS": "Cairns",
+    "AKL": "Auckland",
+    "SYD": "Sydney",
+    "GOV": "Nhulunbuy",
+    "DUD": "Dunedin",
+    "DRW": "Darwin"
+}
+
+_TOKEN = re.compile(r"\w+(?:['’.]\w+)*")
+_NAME_SUFFIX = re.compile(r"\s+(?:international\s+|intl\.?\s+|regional\s+|domestic\s+)?(?:airport|airfield|aerodrome)$",
+                          re.IGNORECASE)
+
+# Candidate ranks: overrides beat international airports, which beat the rest
+_RANK_OVERRIDE, _RANK_INTERNATIONAL, _RANK_OTHER = 0, 1, 2
+
+# Trie nodes are dicts of token -> child. Where an alias ends, the node holds
+# (place name candidates, code) under this key; nodes with no children are
+# collapsed into that tuple alone, which keeps ~25k leaves small.
+_TERMINAL = None
+
+
+class AirportGazetteer:
+    def __init__(self, path=AIRPORT_DATA_PATH):
+        self.path = path
+        self._cities = None
+        self._trie = None
+        self._lock = threading.Lock()
+
+    def city(self, code):
+        self._ensure_loaded()
+        return self._cities.get(code)
+
+    def find_mentions(self, text, known_codes=()):
+        # One left-to-right pass over the tokens, taking the longest alias that
+        # starts at each position, so lookups never scan the airport list.
+        self._ensure_loaded()
+        tokens = [(match.start(), match.end(), _fold(match.group())) for match in _TOKEN.finditer(text)]
+        mentions = []
+        position = 0
+        while position < len(tokens):
+            node = self._trie
+            matches = []
+            for end in range(position, len(tokens)):
+                node = node.get(tokens[end][2]) if isinstance(node, dict) else None
+                if node is None:
+                    break
+                terminal = node.get(_TERMINAL) if isinstance(node, dict) else node
+                if terminal:
+                    matches.append((end, terminal))
+
+            for end, terminal in reversed(matches):
+                start, stop = tokens[position][0], tokens[end][1]
+                code = _pick_candidate(text[start:stop], terminal, known_codes)
+                if code:
+                    mentions.append((start, stop, code))
+                    position = end
+                    break
+            position += 1
+        return mentions
+
+    def _ensure_loaded(self):
+        if self._trie is not None:
+            return
+        with self._lock:
+            if self._trie is None:
+                self._load()
+
+    def _load(self):
+        cities = {}
+        names = {}
+        codes = {}
+        with gzip.open(self.path, "rt", encoding="utf-8", newline="") as data:
+            for row in csv.DictReader(data):
+                iata, icao, name, city = sys.intern(row["iata"]), row["icao"], row["name"], row["city"]
+                cities[iata] = CITY_OVERRIDES.get(iata, city or name)
+                rank = _RANK_INTERNATIONAL if "international" in name.lower() else _RANK_OTHER
+                for alias in (city, name, _NAME_SUFFIX.sub("", name)):
+                    _add_name(names, alias, iata, rank)
+                for code in (iata, icao):
+                    if code:
+                        codes[(_fold(code),)] = iata
+        for iata, city in CITY_OVERRIDES.items():
+            _add_name(names, city, iata, _RANK_OVERRIDE)
+
+        trie = {}
+        for tokens in names.keys() | codes.keys():
+            node = trie
+            for token in tokens:
+                node = node.setdefault(token, {})
+            candidates = names.get(tokens, {})
+            node[_TERMINAL] = (tuple(sorted(candidates, key=candidates.get)), codes.get(tokens))
+
+        self._cities = cities
+        self._trie = _collapse_leaves(trie)
+
+
+def _add_name(names, alias, iata, rank):
+    tokens = tuple(sys.intern(_fold(token)) for token in _TOKEN.findall(alias or ""))
+    if tokens:
+        candidates = names.setdefault(tokens, {})
+        candidates[iata] = min(rank, candidates.get(iata, rank))
+
+
+def _collapse_leaves(node):
+    if len(node) == 1 and _TERMINAL in node:
+        return node[_TERMINAL]
+    for token, child in node.items():
+        if token is not _TERMINAL:
+            node[token] = _collapse_leaves(child)
+    return node
+
+
+def _pick_candidate(surface, terminal, known_codes):
+    candidates, code = terminal
+    # Codes must be written in capitals, and three-letter ones must be an
+    # airport we hold flights for, since many are words ("THE", "ALL")
+    if code and surface.isupper() and (code in known_codes or len(surface) == 4):
+        return code
+    if not surface[:1].isupper():
+        # Lower-case place names only count for airports we hold flights for,
+        # so everyday words like "nice" are not read as airports
+        candidates = [iata for iata in candidates if iata in known_codes]
+    return next((iata for iata in candidates if iata in known_codes), candidates[0] if candidates else None)
+
+
+def _fold(token):
+    # Case and accents are ignored, so "zurich" finds "Zürich"
+    decomposed = unicodedata.normalize("NFKD", token.casefold())
+    return "".join(char for char in decomposed if not unicodedata.combining(char))
+
+
+_gazetteer = None
+_gazetteer_lock = threading.Lock()
+
+
+def get_gazetteer():
+    global _gazetteer
+    with _gazetteer_lock:
+        if _gazetteer is None:
+            _gazetteer = AirportGazetteer()
+        return _gazetteer
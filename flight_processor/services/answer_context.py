@@ -0,0 +1,43 @@
+import re
+from persistence.models import ANSWER_PROMPT
+from config import ANSWER_CONTEXT_TOKENS, ANSWER_MAX_TOKENS, LLAMA_MODEL_N_CTX
+
+_SCHEDULE_TIME = re.compile(r"^(\d{4}-\d{2}-\d{2})[T ](\d{2}:\d{2})(?::\d{2}(?:\.\d+)?)?(.*)$")
+
+
+def build_answer_context(query, columns, flights, count_tokens, budget=ANSWER_CONTEXT_TOKENS):
+    # Flights arrive best hit first and are added in that order until the
+    # budget is spent, which also leaves room in n_ctx for the prompt and answer
+    budget = min(budget, LLAMA_MODEL_N_CTX - ANSWER_MAX_TOKENS
+                 - count_tokens(ANSWER_PROMPT.format(query=query, flight_data="")))
+    lines = []
+    for flight in flights:
+        line = _render_flight(dict(zip(columns, flight)))
+        cost = count_tokens(line + "\n")
+        if cost > budget:
+            break
+        lines.append(line)
+        budget -= cost
+    return "\n".join(lines), len(lines)
+
+
+def _render_flight(flight):
+    # One terse line per flight, leaving out empty fields rather than writing "None"
+    origin_date = flight.get("origin_date_local")
+    route = " -> ".join(
+        " ".join(part for part in (port, _short_time(time, origin_date)) if part)
+        for port, time in ((flight.get("departure_port"), flight.get("departure_time")),
+                           (flight.get("arrival_port"), flight.get("arrival_time")))
+    )
+    parts = (f"{flight.get('airline') or ''}{flight.get('flight_number') or ''}", origin_date, route,
+             flight.get("aircraft_type"), flight.get("aircraft_registration"), flight.get("status"))
+    return " | ".join(str(part) for part in parts if part and part != " -> ")
+
+
+def _short_time(value, origin_date):
+    # "2024-12-09T06:00:00+13:00" on a flight dated 2024-12-09 becomes "06:00+13:00"
+    match = _SCHEDULE_TIME.match(value or "")
+    if not match:
+        return value
+    day, clock, offset = match.groups()
+    return f"{clock}{offset}" if day == origin_date else f"{day} {clock}{offset}"
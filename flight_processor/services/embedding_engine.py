@@ -0,0 +1,76 @@
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from config import (
+    LLAMA_MODEL_PATH, LLAMA_EMBED_BATCH_SIZE, LLAMA_EMBED_N_BATCH, LLAMA_EMBED_WORKERS
+)
+
+_worker_model = None
+
+
+def embed_with_llama(llama, texts, batch_size=LLAMA_EMBED_BATCH_SIZE):
+    # Llama.embed packs several sequences into one decode call as long as they
+    # fit in n_batch tokens, instead of evaluating the texts one by one.
+    vectors = []
+    for start in range(0, len(texts), batch_size):
+        for embedding in llama.embed(texts[start:start + batch_size]):
+            vectors.append(_pool_embedding(embedding))
+    return vectors
+
+
+def _pool_embedding(embedding):
+    # Models without a pooling layer return one vector per token; average them
+    if embedding and isinstance(embedding[0], list):
+        return [sum(values) / len(embedding) for values in zip(*embedding)]
+    return list(map(float, embedding))
+
+
+def _init_worker(model_path, n_threads):
+    global _worker_model
+    from llama_cpp import Llama
+    _worker_model = Llama(model_path=model_path, embedding=True, n_ctx=LLAMA_EMBED_N_BATCH,
+                          n_batch=LLAMA_EMBED_N_BATCH, n_threads=n_threads, verbose=False)
+
+
+def _embed_in_worker(texts):
+    return embed_with_llama(_worker_model, texts)
+
+
+class LlamaEmbeddingEngine:
+    def __init__(self, workers=LLAMA_EMBED_WORKERS, model_path=LLAMA_MODEL_PATH):
+        self.workers = workers
+        self.model_path = model_path
+
+    def prefetch(self, batches, cached_embeddings):
+        # Batches come back in completion order once all of their vectors are in
+        # the embedding cache, so indexing them afterwards never hits the model.
+        n_threads = max(1, (os.cpu_count() or 1) // self.workers)
+        # The GGUF weights are memory-mapped, so workers share one copy in the page cache
+        with ProcessPoolExecutor(max_workers=self.workers,
+                                 mp_context=multiprocessing.get_context("spawn"),
+                                 initializer=_init_worker,
+                                 initargs=(self.model_path, n_threads)) as pool:
+            in_flight = {}
+            for batch in batches:
+                texts = [document.page_content for _, _, document in batch]
+                missing = [text for text, vector in zip(texts, cached_embeddings.cached_vectors(texts))
+                           if vector is None]
+                if not missing:
+                    yield batch
+                    continue
+
+                in_flight[pool.submit(_embed_in_worker, missing)] = (batch, missing)
+                # Keep every worker busy without queueing the whole table in memory
+                while len(in_flight) >= self.workers * 2:
+                    yield from self._collect(in_flight, cached_embeddings)
+
+            while in_flight:
+                yield from self._collect(in_flight, cached_embeddings)
+
+    @staticmethod
+    def _collect(in_flight, cached_embeddings):
+        done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+        for future in done:
+            batch, missing = in_flight.pop(future)
+            cached_embeddings.store_vectors(missing, future.result())
+            yield batch
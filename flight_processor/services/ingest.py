@@ -0,0 +1,238 @@
+import os
+import tempfile
+import itertools
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+from persistence.database import store_flights_bulk
+from persistence.ingest_cache import (
+    content_hash, content_hash_blocks, get_ingested_hashes, mark_files_ingested, get_cached_extractions, store_extractions
+)
+from services.xml_parser import (
+    iter_atom_flights, spool_atom_flights, read_spooled_flights, complete_with_llm, needs_llm_completion,
+    _parse_with_openai
+)
+from config import (
+    INGEST_PARSE_WORKERS, INGEST_SPOOL_BLOCK_BYTES, OPENAI_MAX_CONCURRENCY, TIERED_EXTRACTION,
+    BULK_INSERT_CHUNK_SIZE
+)
+
+_parse_pool = None
+_parse_pool_lock = threading.Lock()
+
+
+def _get_parse_pool():
+    # Spawning workers imports the parser stack, so the pool is created once
+    # per process and reused by every upload.
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is None:
+            _parse_pool = ProcessPoolExecutor(
+                max_workers=INGEST_PARSE_WORKERS,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return _parse_pool
+
+
+def _discard_parse_pool(pool):
+    # A pool whose worker died (out of memory on a large file, say) refuses all
+    # further work, so it is dropped and the next upload spawns a fresh one
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is pool:
+            _parse_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def ingest_files(files, api_key=None, use_openai=False, on_progress=None):
+    # `files` holds (name, binary file object) pairs. One summary per uploaded
+    # file, in upload order, since two uploads may share a name
+    summary = [{"name": name, "stored": 0, "failed": 0, "errors": [], "skipped": False} for name, _ in files]
+    stats = {"files_skipped": 0, "extraction_cache_hits": 0, "extraction_cache_misses": 0}
+    extractor = _extractor_name(use_openai)
+    new_extractions = []
+    row_files = []
+
+    with tempfile.TemporaryDirectory(prefix="flight_ingest_") as spool_dir:
+        spooled_files = [(index, *_spool_upload(file_obj, os.path.join(spool_dir, f"{index}.xml")))
+                         for index, (_, file_obj) in enumerate(files)]
+        seen = get_ingested_hashes(digest for _, _, digest in spooled_files)
+        pending = []
+        for index, path, digest in spooled_files:
+            if digest in seen:
+                summary[index]["skipped"] = True
+                stats["files_skipped"] += 1
+            else:
+                seen.add(digest)
+                pending.append((index, path, digest))
+
+        def flights():
+            # Files are keyed by their position from here on
+            done = 0
+            parsed_files = _parse_files(pending, api_key, use_openai, extractor, stats, new_extractions)
+            for index, parsed, finished in parsed_files:
+                for flight_data in parsed:
+                    if "error" in flight_data:
+                        summary[index]["errors"].append(flight_data["error"])
+                    else:
+                        if "extraction_error" in flight_data:
+                            # Stored with the parsed fields, but the file stays un-ingested so it is retried
+                            summary[index]["errors"].append(
+                                f"Stored with missing fields: {flight_data['extraction_error']}")
+                        row_files.append(index)
+                        yield flight_data
+                if finished:
+                    done += 1
+                    if on_progress:
+                        on_progress(summary[index]["name"], done, len(pending))
+
+        results = store_flights_bulk(flights())
+    for index, stored in zip(row_files, results):
+        summary[index]["stored" if stored else "failed"] += 1
+
+    if new_extractions:
+        store_extractions(new_extractions, extractor)
+    mark_files_ingested([
+        (digest, summary[index]["name"]) for index, _, digest in pending
+        if summary[index]["stored"] and not summary[index]["failed"] and not summary[index]["errors"]
+    ])
+    return summary, stats
+
+
+def _spool_upload(file_obj, path):
+    # Copied to disk a block at a time and hashed on the way, so parser
+    # workers are handed a path rather than the file's bytes
+    file_obj.seek(0)
+    with open(path, "wb") as spool:
+        def blocks():
+            for block in iter(lambda: file_obj.read(INGEST_SPOOL_BLOCK_BYTES), b""):
+                spool.write(block)
+                yield block
+        digest = content_hash_blocks(blocks())
+    return path, digest
+
+
+def _extractor_name(use_openai):
+    if not use_openai:
+        return "atom"
+    return "openai-tiered" if TIERED_EXTRACTION else "openai"
+
+
+def _parse_files(files, api_key, use_openai, extractor, stats, new_extractions):
+    # `files` holds (key, path, digest) triples; results come back under the same key
+    parsed_files = _parse_atom_files([(name, path) for name, path, _ in files])
+    if not use_openai:
+        for name, parsed in parsed_files:
+            yield name, parsed, True
+        return
+
+    documents = {name: (path, digest) for name, path, digest in files}
+    ctx = get_script_run_ctx()
+    with ThreadPoolExecutor(max_workers=OPENAI_MAX_CONCURRENCY,
+                            initializer=lambda: add_script_run_ctx(threading.current_thread(), ctx)) as llm_pool:
+        llm_futures = {}
+        remaining = {}
+
+        def extract(name, needs_llm):
+            # `needs_llm` holds (digest, raw_data, extract function, its input);
+            # cached extractions come straight back, the rest go to the LLM pool
+            cached = get_cached_extractions((digest for digest, _, _, _ in needs_llm), extractor)
+            ready = []
+            for digest, raw_data, extract_fields, source in needs_llm:
+                if digest in cached:
+                    stats["extraction_cache_hits"] += 1
+                    ready.append({**cached[digest], "raw_data": raw_data})
+                    continue
+                stats["extraction_cache_misses"] += 1
+                llm_futures[llm_pool.submit(extract_fields, source, api_key)] = (name, digest)
+                remaining[name] += 1
+            return ready
+
+        for name, parsed in parsed_files:
+            remaining[name] = 0
+            errors = []
+            found = False
+            # Taken a chunk at a time, so a large file is never held whole
+            for batch in _batches(parsed, BULK_INSERT_CHUNK_SIZE):
+                ready = []
+                needs_llm = []
+                for flight_data in batch:
+                    if "error" in flight_data:
+                        errors.append(flight_data)
+                        continue
+                    found = True
+                    if TIERED_EXTRACTION and not needs_llm_completion(flight_data):
+                        ready.append(flight_data)
+                    elif TIERED_EXTRACTION:
+                        needs_llm.append((content_hash(flight_data["raw_data"]), flight_data["raw_data"],
+                                          complete_with_llm, flight_data))
+                    else:
+                        needs_llm.append((content_hash(flight_data["raw_data"]), flight_data["raw_data"],
+                                          _parse_with_openai, flight_data["raw_data"]))
+                ready.extend(extract(name, needs_llm))
+                if ready:
+                    yield name, ready, False
+
+            if errors and not found:
+                # Nothing the parser could read, so the LLM gets the whole
+                # document, as every document did before tiered extraction
+                path, digest = documents[name]
+                with open(path, encoding="utf-8", errors="replace") as document_file:
+                    document = document_file.read()
+                ready = extract(name, [(digest, document, _parse_with_openai, document)])
+            else:
+                ready = errors
+            if ready or not remaining[name]:
+                yield name, ready, not remaining[name]
+
+        for future in as_completed(llm_futures):
+            name, digest = llm_futures[future]
+            remaining[name] -= 1
+            try:
+                flight_data = future.result()
+            except Exception as e:
+                flight_data = {"error": f"Extraction failed: {str(e)}", "raw_data": None}
+            if "error" not in flight_data and "extraction_error" not in flight_data:
+                new_extractions.append((digest, flight_data))
+            yield name, [flight_data], remaining[name] == 0
+
+
+def _batches(items, size):
+    items = iter(items)
+    while True:
+        batch = list(itertools.islice(items, size))
+        if not batch:
+            return
+        yield batch
+
+
+def _parse_atom_files(files):
+    if len(files) == 1:
+        name, path = files[0]
+        yield name, iter_atom_flights(path)
+        return
+
+    # Workers write their flights to a spool file beside the upload, read
+    # back here one flight at a time once the file is done
+    pool = _get_parse_pool()
+    try:
+        futures = {pool.submit(spool_atom_flights, path, path + ".flights"): (name, path) for name, path in files}
+    except BrokenProcessPool:
+        # Broken since the last upload finished
+        _discard_parse_pool(pool)
+        pool = _get_parse_pool()
+        futures = {pool.submit(spool_atom_flights, path, path + ".flights"): (name, path) for name, path in files}
+
+    for future in as_completed(futures):
+        name, path = futures[future]
+        try:
+            future.result()
+            parsed = read_spooled_flights(path + ".flights")
+        except BrokenProcessPool:
+            _discard_parse_pool(pool)
+            parsed = [{"error": "Parsing failed: the parser process stopped unexpectedly", "raw_data": None}]
+        except Exception as e:
+            parsed = [{"error": f"Parsing failed: {str(e)}", "raw_data": None}]
+        yield name, parsed
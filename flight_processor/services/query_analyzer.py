@@ -0,0 +1,159 @@
+import re
+import calendar
+from datetime import date
+from persistence.database import get_airline_codes, get_port_codes, get_latest_origin_date
+from services.airport_gazetteer import get_gazetteer
+
+_MONTHS = {name.lower(): number for number, name in enumerate(calendar.month_name) if name}
+_MONTHS.update((name.lower(), number) for number, name in enumerate(calendar.month_abbr) if name)
+_MONTHS["sept"] = 9
+_MONTH_PATTERN = "|".join(sorted(_MONTHS, key=len, reverse=True))
+
+_ISO_DATE = re.compile(r"\b(\d{4})-(\d{1,2})-(\d{1,2})\b")
+_DAY_MONTH = re.compile(rf"\b(\d{{1,2}})(?:st|nd|rd|th)?\s+(?:of\s+)?({_MONTH_PATTERN})\.?(?:,?\s+(\d{{4}}))?\b",
+                        re.IGNORECASE)
+_MONTH_DAY = re.compile(rf"\b({_MONTH_PATTERN})\.?\s+(\d{{1,2}})(?:st|nd|rd|th)?\b(?:,?\s+(\d{{4}})\b)?",
+                        re.IGNORECASE)
+_FLIGHT_DESIGNATOR = re.compile(r"\b([A-Z]{2,3}|[A-Z][0-9]|[0-9][A-Z])\s?(\d{1,4})\b", re.IGNORECASE)
+_FLIGHT_NUMBER = re.compile(r"\bflight\s+(?:number\s+|no\.?\s+|#)?(\d{1,4})\b", re.IGNORECASE)
+_UPPER_CODE = re.compile(r"\b[A-Z0-9]{2,3}\b")
+
+_DEPARTURE_CUES = {"from", "departing", "leaving", "ex", "out of", "departs"}
+_ARRIVAL_CUES = {"to", "into", "arriving", "arrives", "landing", "towards", "for", "in"}
+
+
+def analyze_query(query):
+    analysis = {"airline": None, "flight_number": None, "date_from": None, "date_to": None,
+                "departure_port": None, "arrival_port": None}
+    airlines = get_airline_codes()
+    consumed = []
+
+    for match in _FLIGHT_DESIGNATOR.finditer(query):
+        airline = airlines.get(match.group(1).upper())
+        if airline:
+            analysis["airline"] = airline
+            analysis["flight_number"] = normalize_flight_number(match.group(2))
+            consumed.append(match.span())
+            break
+
+    if analysis["flight_number"] is None:
+        match = _FLIGHT_NUMBER.search(query)
+        if match:
+            analysis["flight_number"] = normalize_flight_number(match.group(1))
+            consumed.append(match.span())
+
+    if analysis["airline"] is None:
+        # Bare codes only count when written in capitals, so words like "and" never match
+        for match in _UPPER_CODE.finditer(query):
+            if match.group() in airlines:
+                analysis["airline"] = airlines[match.group()]
+                consumed.append(match.span())
+                break
+
+    dates, date_spans = _find_dates(query)
+    if dates:
+        analysis["date_from"], analysis["date_to"] = min(dates), max(dates)
+    consumed.extend(date_spans)
+
+    analysis["departure_port"], analysis["arrival_port"] = _resolve_ports(query, consumed)
+    return analysis
+
+
+def build_metadata_filter(analysis):
+    conditions = []
+    for field in ("airline", "flight_number", "departure_port", "arrival_port"):
+        if analysis.get(field):
+            conditions.append({field: {"$eq": analysis[field]}})
+    if analysis.get("date_from"):
+        conditions.append({"origin_date": {"$gte": date_key(analysis["date_from"])}})
+    if analysis.get("date_to"):
+        conditions.append({"origin_date": {"$lte": date_key(analysis["date_to"])}})
+
+    if not conditions:
+        return None
+    if len(conditions) == 1:
+        return conditions[0]
+    return {"$and": conditions}
+
+
+def normalize_flight_number(flight_number):
+    return str(flight_number).strip().lstrip("0") or "0"
+
+
+def date_key(value):
+    # Chroma only range-filters numbers, so dates are stored as YYYYMMDD integers
+    if isinstance(value, date):
+        return value.year * 10000 + value.month * 100 + value.day
+    digits = str(value).replace("-", "")[:8]
+    return int(digits) if len(digits) == 8 and digits.isdigit() else None
+
+
+def _find_dates(query):
+    dates = []
+    spans = []
+    default_year = None
+
+    for match in _ISO_DATE.finditer(query):
+        _append_date(dates, int(match.group(1)), int(match.group(2)), int(match.group(3)))
+        spans.append(match.span())
+
+    for pattern, day_group, month_group in ((_DAY_MONTH, 1, 2), (_MONTH_DAY, 2, 1)):
+        for match in pattern.finditer(query):
+            if _overlaps(match.span(), spans):
+                continue
+            year = match.group(3)
+            if year is None:
+                # Without a year, assume the most recent schedule year we hold
+                if default_year is None:
+                    latest = date_key(get_latest_origin_date() or "")
+                    default_year = latest // 10000 if latest else date.today().year
+                year = default_year
+            _append_date(dates, int(year), _MONTHS[match.group(month_group).lower().rstrip(".")],
+                         int(match.group(day_group)))
+            spans.append(match.span())
+    return dates, spans
+
+
+def _append_date(dates, year, month, day):
+    try:
+        dates.append(date(year, month, day))
+    except ValueError:
+        pass
+
+
+def _resolve_ports(query, consumed):
+    mentions = [(start, code) for start, end, code in get_gazetteer().find_mentions(query, get_port_codes())
+                if not _overlaps((start, end), consumed)]
+
+    departure = arrival = None
+    unassigned = []
+    for start, code in mentions:
+        cue = _preceding_cue(query[:start])
+        if cue in _DEPARTURE_CUES and departure is None:
+            departure = code
+        elif cue in _ARRIVAL_CUES and arrival is None:
+            arrival = code
+        else:
+            unassigned.append(code)
+
+    # An unqualified mention fills whichever end of the route is still open,
+    # starting with the departure as in "Sydney to Auckland"
+    for code in unassigned:
+        if code in (departure, arrival):
+            continue
+        if departure is None:
+            departure = code
+        elif arrival is None:
+            arrival = code
+    return departure, arrival
+
+
+def _preceding_cue(prefix):
+    words = prefix.lower().split()
+    if len(words) >= 2 and " ".join(words[-2:]) in _DEPARTURE_CUES:
+        return " ".join(words[-2:])
+    return words[-1] if words else None
+
+
+def _overlaps(span, spans):
+    return any(span[0] < end and start < span[1] for start, end in spans)
@@ -1,19 +1,81 @@
 import os
+import re
+import json
+import sqlite3
+import hashlib
+import itertools
+from array import array
+from datetime import date, timedelta
 import streamlit as st
 from langchain.schema import Document
 from langchain_community.vectorstores import Chroma
-from config import OPENAI_VECTOR_PATH, LLAMA_VECTOR_PATH, VECTOR_SEARCH_TOP_K
+from config import (
+    OPENAI_VECTOR_PATH, LLAMA_VECTOR_PATH, VECTOR_SEARCH_TOP_K, VECTOR_MANIFEST_FILE, VECTOR_UPSERT_BATCH_SIZE,
+    LLAMA_EMBED_WORKERS, SEARCH_CACHE_MAX_BYTES, HYDE_CACHE_MAX_BYTES, HYBRID_CANDIDATES, HYBRID_RRF_K,
+    VECTOR_BACKEND, NUMPY_COMPACT_DEAD_FRACTION, NUMPY_QUANTIZATION, VECTOR_SHARD_BY_DATE, VECTOR_RETENTION_DAYS
+)
 from persistence.models import ModelFactory
+from persistence.numpy_vector_store import NumpyVectorStore
+from persistence.sharded_vector_store import DateShardedVectorStore
+from persistence.vector_versions import (
+    staged_version, current_version_path, retire_all_versions, collect_retired_versions
+)
+from persistence.query_cache import QueryResultCache
+from services.query_analyzer import analyze_query, build_metadata_filter, normalize_flight_number, date_key
+from services.airport_gazetteer import get_gazetteer
+from services.embedding_engine import LlamaEmbeddingEngine
+
+# Ranked hits per (backend, query, k) and HyDE documents with their vectors.
+# Both are dropped whenever a store is rebuilt or reloaded.
+_search_cache = QueryResultCache(max_bytes=SEARCH_CACHE_MAX_BYTES)
+_hyde_cache = QueryResultCache(max_bytes=HYDE_CACHE_MAX_BYTES)
+
+_FTS_TOKEN = re.compile(r"\w+(?:-\w+)*")
+_IDENTIFIER = re.compile(r"[A-Za-z].*[\d-]|\d.*[A-Za-z]")
+
+
+def invalidate_search_caches():
+    _search_cache.invalidate()
+    _hyde_cache.invalidate()
+
+
+def vector_store_path(use_openai=True, backend=VECTOR_BACKEND, shard_by_date=VECTOR_SHARD_BY_DATE):
+    base_path = OPENAI_VECTOR_PATH if use_openai else LLAMA_VECTOR_PATH
+    # Each backend and layout keeps its own versions, so switching never reuses another's
+    parts = [] if backend == "chroma" else [backend]
+    if shard_by_date:
+        parts.append("by_date")
+    return os.path.join(base_path, *parts)
+
+
+def has_vector_store(use_openai=True):
+    return current_version_path(vector_store_path(use_openai)) is not None
+
+
+def clear_vector_stores():
+    # Searches still holding a store keep working until the grace period ends
+    for use_openai in (True, False):
+        for backend in ("chroma", "numpy"):
+            for shard_by_date in (False, True):
+                root = vector_store_path(use_openai, backend, shard_by_date)
+                if os.path.isdir(root):
+                    retire_all_versions(root)
+    invalidate_search_caches()
+
+
+def _open_store(vector_path, embeddings):
+    if VECTOR_SHARD_BY_DATE:
+        return DateShardedVectorStore(persist_directory=vector_path, embedding_function=embeddings,
+                                      open_shard=_open_backend)
+    return _open_backend(vector_path, embeddings)
+
+
+def _open_backend(vector_path, embeddings):
+    if VECTOR_BACKEND == "numpy":
+        return NumpyVectorStore(persist_directory=vector_path, embedding_function=embeddings,
+                                quantization=NUMPY_QUANTIZATION)
+    return Chroma(persist_directory=vector_path, embedding_function=embeddings)
 
-# Simple mapping; replace or extend with a full list as needed
-IATA_TO_CITY = {
-    "CNS": "Cairns",
-    "AKL": "Auckland",
-    "SYD": "Sydney",
-    "GOV": "Nhulunbuy",
-    "DUD": "Dunedin",
-    "DRW": "Darwin"
-}
 
 def setup_vector_store(db_conn, api_key=None, use_openai=True):
     embeddings = ModelFactory.get_embeddings(api_key, use_openai)
@@ -21,95 +83,363 @@ def setup_vector_store(db_conn, api_key=None, use_openai=True):
         st.error("Failed to initialize embeddings model")
         return None
 
-    cursor = db_conn.cursor()
-    cursor.execute("""
-                   SELECT id,
-                          airline,
-                          flight_number,
-                          departure_port,
-                          departure_time,
-                          arrival_port,
-                          arrival_time,
-                          aircraft_type,
-                          aircraft_registration,
-                          status
-                   FROM flights
-                   """)
-    flight_data = cursor.fetchall()
-
-    if not flight_data:
-        st.warning("No flight data found in database")
-        return None
-
     try:
-        documents = []
-        for (flight_id, airline, flight_number, dep_port, dep_time,
-             arr_port, arr_time, aircraft_type, aircraft_reg, status) in flight_data:
-            # Enrich text with city names
-            dep_city = IATA_TO_CITY.get(dep_port, dep_port)
-            arr_city = IATA_TO_CITY.get(arr_port, arr_port)
-            text = (
-                f"Flight {airline}{flight_number} from {dep_city} ({dep_port}) at {dep_time} "
-                f"to {arr_city} ({arr_port}) at {arr_time}. "
-                f"Aircraft: {aircraft_type} (Reg: {aircraft_reg}). Status: {status}"
-            )
-            documents.append(Document(page_content=text, metadata={"id": str(flight_id),
-                                                           "departure_port": dep_port}))
-
-        vector_path = OPENAI_VECTOR_PATH if use_openai else LLAMA_VECTOR_PATH
-        os.makedirs(vector_path, exist_ok=True)
-
-        return Chroma.from_documents(
-            documents=documents,
-            embedding=embeddings,
-            persist_directory=vector_path
-        )
+        # Built beside the live version and swapped in only once complete
+        with staged_version(vector_store_path(use_openai)) as vector_path:
+            vector_store = _build_store(db_conn, vector_path, embeddings, use_openai)
+        invalidate_search_caches()
+
+        if not db_conn.execute("SELECT 1 FROM flights LIMIT 1").fetchone():
+            st.warning("No flight data found in database")
+            return None
+        return vector_store
     except Exception as e:
         st.error(f"Error creating vector store: {str(e)}")
         return None
 
 
+def _build_store(db_conn, vector_path, embeddings, use_openai):
+    vector_store = _open_store(vector_path, embeddings)
+    manifest = _open_manifest(vector_path)
+    indexed = dict(manifest.execute("SELECT flight_id, text_hash FROM indexed_documents"))
+
+    cutoff = _retention_cutoff(db_conn)
+    if cutoff and hasattr(vector_store, "drop_dates_before"):
+        # Days past retention go a whole shard at a time
+        dropped = [int(flight_id) for flight_id in vector_store.drop_dates_before(date_key(cutoff))]
+        _forget_documents(manifest, dropped)
+        for flight_id in dropped:
+            indexed.pop(flight_id, None)
+
+    if indexed and not manifest.execute("SELECT 1 FROM documents_fts LIMIT 1").fetchone():
+        # Stores indexed before the lexical index existed get it filled in once
+        _backfill_lexical_index(manifest, db_conn, cutoff)
+
+    # A store persisted before the manifest existed holds documents under
+    # random ids, so it is rebuilt from scratch once.
+    if not indexed and vector_store.get(limit=1)["ids"]:
+        vector_store.delete_collection()
+        vector_store = _open_store(vector_path, embeddings)
+
+    cursor = db_conn.cursor()
+    cursor.execute(DOCUMENT_ROWS_SQL, (cutoff or "",))
+
+    batches = _changed_batches(cursor, indexed)
+    if not use_openai and LLAMA_EMBED_WORKERS > 1:
+        # Worker processes only pay off when there is enough to embed
+        head = list(itertools.islice(batches, LLAMA_EMBED_WORKERS))
+        batches = itertools.chain(head, batches)
+        if len(head) == LLAMA_EMBED_WORKERS:
+            batches = LlamaEmbeddingEngine().prefetch(batches, embeddings)
+
+    for batch in batches:
+        _upsert_documents(vector_store, manifest, batch)
+
+    # Whatever is left in the manifest no longer exists in the flights table
+    # (or has fallen out of retention)
+    if indexed:
+        stale_ids = list(indexed)
+        vector_store.delete(ids=[str(flight_id) for flight_id in stale_ids])
+        _forget_documents(manifest, stale_ids)
+    manifest.commit()
+    manifest.close()
+
+    # The flat store only appends, so rewrite it once enough rows are dead
+    if hasattr(vector_store, "compact"):
+        vector_store.compact(min_dead_fraction=NUMPY_COMPACT_DEAD_FRACTION)
+    return vector_store
+
+
+DOCUMENT_ROWS_SQL = """
+                    SELECT id,
+                           airline,
+                           flight_number,
+                           origin_date_local,
+                           departure_port,
+                           departure_time,
+                           arrival_port,
+                           arrival_time,
+                           aircraft_type,
+                           aircraft_registration,
+                           status
+                    FROM flights
+                    WHERE origin_date_local IS NULL OR origin_date_local >= ?
+                    """
+
+
+def _retention_cutoff(db_conn):
+    # Earliest origin date still indexed, counted back from the latest schedule day
+    if VECTOR_RETENTION_DAYS is None:
+        return None
+    latest = db_conn.execute("SELECT MAX(origin_date_local) FROM flights").fetchone()[0]
+    try:
+        return (date.fromisoformat(latest[:10]) - timedelta(days=VECTOR_RETENTION_DAYS)).isoformat()
+    except (TypeError, ValueError):
+        return None
+
+
+def _changed_batches(cursor, indexed):
+    # Rows whose document hash matches the manifest are dropped from `indexed`,
+    # so once this is exhausted `indexed` holds only deleted flights.
+    batch = []
+    for row in cursor:
+        document = _flight_document(row)
+        text_hash = _document_hash(document)
+        if indexed.pop(row[0], None) == text_hash:
+            continue
+
+        batch.append((row[0], text_hash, document))
+        if len(batch) >= VECTOR_UPSERT_BATCH_SIZE:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _flight_document(row):
+    (flight_id, airline, flight_number, origin_date, dep_port, dep_time,
+     arr_port, arr_time, aircraft_type, aircraft_reg, status) = row
+    # Enrich text with city names
+    gazetteer = get_gazetteer()
+    dep_city = gazetteer.city(dep_port) or dep_port
+    arr_city = gazetteer.city(arr_port) or arr_port
+    text = (
+        f"Flight {airline}{flight_number} from {dep_city} ({dep_port}) at {dep_time} "
+        f"to {arr_city} ({arr_port}) at {arr_time}. "
+        f"Aircraft: {aircraft_type} (Reg: {aircraft_reg}). Status: {status}"
+    )
+    metadata = {"id": str(flight_id), "departure_port": dep_port}
+    # Structured fields for pre-filtering; Chroma rejects None, so gaps are left out
+    extra = {"airline": airline, "arrival_port": arr_port,
+             "flight_number": normalize_flight_number(flight_number) if flight_number else None,
+             "origin_date": date_key(origin_date) if origin_date else None}
+    metadata.update((key, value) for key, value in extra.items() if value is not None)
+    return Document(page_content=text, metadata=metadata)
+
+
+def _document_hash(document):
+    payload = document.page_content + json.dumps(document.metadata, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _open_manifest(vector_path):
+    manifest = sqlite3.connect(os.path.join(vector_path, VECTOR_MANIFEST_FILE))
+    manifest.execute("""
+                     CREATE TABLE IF NOT EXISTS indexed_documents (
+                         flight_id INTEGER PRIMARY KEY,
+                         text_hash TEXT
+                     )
+                     """)
+    # Lexical index over the same document text, keyed by flight id
+    manifest.execute("""
+                     CREATE VIRTUAL TABLE IF NOT EXISTS documents_fts
+                     USING fts5(text, tokenize = 'porter unicode61')
+                     """)
+    return manifest
+
+
+def _upsert_documents(vector_store, manifest, batch):
+    vector_store.add_documents([document for _, _, document in batch],
+                               ids=[str(flight_id) for flight_id, _, _ in batch])
+    # Committing per batch lets an interrupted build resume where it stopped
+    manifest.executemany("INSERT OR REPLACE INTO indexed_documents (flight_id, text_hash) VALUES (?, ?)",
+                         [(flight_id, text_hash) for flight_id, text_hash, _ in batch])
+    _index_lexical(manifest, [(flight_id, document) for flight_id, _, document in batch])
+    manifest.commit()
+
+
+def _index_lexical(manifest, documents):
+    manifest.executemany("DELETE FROM documents_fts WHERE rowid = ?", [(flight_id,) for flight_id, _ in documents])
+    manifest.executemany("INSERT INTO documents_fts (rowid, text) VALUES (?, ?)",
+                         [(flight_id, document.page_content) for flight_id, document in documents])
+
+
+def _forget_documents(manifest, flight_ids):
+    manifest.executemany("DELETE FROM indexed_documents WHERE flight_id = ?", [(flight_id,) for flight_id in flight_ids])
+    manifest.executemany("DELETE FROM documents_fts WHERE rowid = ?", [(flight_id,) for flight_id in flight_ids])
+
+
+def _backfill_lexical_index(manifest, db_conn, cutoff=None):
+    cursor = db_conn.execute(DOCUMENT_ROWS_SQL, (cutoff or "",))
+    while True:
+        rows = cursor.fetchmany(VECTOR_UPSERT_BATCH_SIZE)
+        if not rows:
+            break
+        _index_lexical(manifest, [(row[0], _flight_document(row)) for row in rows])
+    manifest.commit()
+
+
 def load_vector_store(api_key=None, use_openai=True):
     embeddings = ModelFactory.get_embeddings(api_key, use_openai)
     if not embeddings:
         st.error("Failed to initialize embeddings model")
         return None
 
-    vector_path = OPENAI_VECTOR_PATH if use_openai else LLAMA_VECTOR_PATH
+    root = vector_store_path(use_openai)
+    vector_path = current_version_path(root)
+    if vector_path is None:
+        st.error("No vector store has been built yet")
+        return None
 
     try:
-        return Chroma(
-            persist_directory=vector_path,
-            embedding_function=embeddings
-        )
+        vector_store = _open_store(vector_path, embeddings)
+        invalidate_search_caches()
+        collect_retired_versions(root)
+        return vector_store
     except Exception as e:
         st.error(f"Error loading vector store: {str(e)}")
         return None
 
 
+def current_vector_store(vector_store, api_key=None, use_openai=True):
+    # Moves a session onto the version published since it loaded its store
+    if vector_store is None or _store_directory(vector_store) == current_version_path(vector_store_path(use_openai)):
+        return vector_store
+    return load_vector_store(api_key, use_openai)
+
+
 def semantic_search(vector_store, query, k=VECTOR_SEARCH_TOP_K):
     if not vector_store:
         return []
 
+    def search(**kwargs):
+        return vector_store.similarity_search(query, k=k, **kwargs)
+
     try:
-        # Check for explicit city mention to filter by departure_port
-        q_lower = query.lower()
-        code = next((iata for iata, city in IATA_TO_CITY.items() if city.lower() in q_lower), None)
-        if code:
-            return vector_store.similarity_search(query, k=k, filter={"departure_port": code})
-        return vector_store.similarity_search(query, k=k)
+        return _cached_search(("semantic", _backend_id(vector_store), _normalize_search_query(query), k),
+                              lambda: _prefiltered_search(query, search))
     except Exception as e:
         st.error(f"Search error: {str(e)}")
         return []
 
 
+def _prefiltered_search(query, search):
+    # Airline, flight number, dates and ports in the query narrow the candidates
+    # first; a filter that matches nothing falls back to the unfiltered search
+    metadata_filter = build_metadata_filter(analyze_query(query))
+    if metadata_filter:
+        results = search(filter=metadata_filter)
+        if results:
+            return results
+    return search()
+
+
 def hyde_search(query, vector_store, api_key=None, use_openai=True, k=VECTOR_SEARCH_TOP_K):
+    if not vector_store:
+        st.error("Failed to initialize models for HyDE search")
+        return [], None
+
+    key = (_backend_id(vector_store), _normalize_search_query(query))
+    try:
+        hypothetical_doc, doc_vector = _hyde_cache.get_or_load(
+            key, lambda: _hypothetical_document(query, api_key, use_openai)
+        )
+
+        def search(**kwargs):
+            return vector_store.similarity_search_by_vector(doc_vector.tolist(), k=k, **kwargs)
+
+        results = _cached_search(("hyde",) + key + (k,), lambda: _prefiltered_search(query, search))
+        return results, hypothetical_doc
+    except Exception as e:
+        st.error(f"HyDE search error: {str(e)}")
+        return [], None
+
+
+def hybrid_search(query, vector_store, use_openai=True, k=VECTOR_SEARCH_TOP_K):
+    if not vector_store:
+        return []
+
+    vector_path = _store_directory(vector_store)
+
+    def search():
+        groups = _lexical_groups(query)
+        if _is_exact_token_query(query):
+            # Identifiers such as QF123 or VH-OQA are answered by the index alone
+            hits = _lexical_search(vector_path, " AND ".join(groups), k)
+            if hits:
+                return [_lexical_document(flight_id, text) for flight_id, text in hits]
+        return _fuse(vector_store, vector_path, query, groups, k)
+
+    try:
+        return _cached_search(("hybrid", _backend_id(vector_store), _normalize_search_query(query), k), search)
+    except Exception as e:
+        st.error(f"Search error: {str(e)}")
+        return []
+
+
+def _fuse(vector_store, vector_path, query, groups, k):
+    # Reciprocal rank fusion: BM25 and cosine scores live on different scales,
+    # so each list contributes 1 / (HYBRID_RRF_K + rank) instead
+    lexical = _lexical_search(vector_path, " OR ".join(groups), HYBRID_CANDIDATES) if groups else []
+    semantic = _prefiltered_search(
+        query, lambda **kwargs: vector_store.similarity_search(query, k=HYBRID_CANDIDATES, **kwargs)
+    )
+
+    scores = {}
+    documents = {}
+    for rank, document in enumerate(semantic):
+        flight_id = int(document.metadata["id"])
+        scores[flight_id] = scores.get(flight_id, 0.0) + 1.0 / (HYBRID_RRF_K + rank + 1)
+        documents[flight_id] = document
+    for rank, (flight_id, text) in enumerate(lexical):
+        scores[flight_id] = scores.get(flight_id, 0.0) + 1.0 / (HYBRID_RRF_K + rank + 1)
+        documents.setdefault(flight_id, _lexical_document(flight_id, text))
+
+    ranked = sorted(scores, key=scores.get, reverse=True)[:k]
+    return [documents[flight_id] for flight_id in ranked]
+
+
+def _lexical_groups(query):
+    # One FTS5 group per query token, each quoted so user input is never parsed
+    # as query syntax; flight designators also match the stored airline code
+    expansions = []
+    analysis = analyze_query(query)
+    if analysis["airline"] and analysis["flight_number"]:
+        number = analysis["flight_number"]
+        expansions = [f"{analysis['airline']}{variant}" for variant in sorted({number, number.zfill(3), number.zfill(4)})]
+
+    groups = []
+    for token in _FTS_TOKEN.findall(query):
+        terms = [token]
+        if expansions and any(char.isdigit() for char in token):
+            terms.extend(expansions)
+        groups.append("(" + " OR ".join('"' + term.replace('"', '""') + '"' for term in terms) + ")")
+    return groups
+
+
+def _is_exact_token_query(query):
+    # An identifier mixing letters with digits or hyphens; plain words such as
+    # "Sydney flights" still go through semantic fusion
+    return any(_IDENTIFIER.search(token) for token in _FTS_TOKEN.findall(query))
+
+
+def _lexical_search(vector_path, match, limit):
+    manifest_path = os.path.join(vector_path, VECTOR_MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        return []
+    manifest = sqlite3.connect(manifest_path)
+    try:
+        return manifest.execute(
+            "SELECT rowid, text FROM documents_fts WHERE documents_fts MATCH ? ORDER BY bm25(documents_fts) LIMIT ?",
+            (match, limit)
+        ).fetchall()
+    except sqlite3.OperationalError:
+        # Stores built before the lexical index existed have no documents_fts yet
+        return []
+    finally:
+        manifest.close()
+
+
+def _lexical_document(flight_id, text):
+    return Document(page_content=text, metadata={"id": str(flight_id)})
+
+
+def _hypothetical_document(query, api_key, use_openai):
     llm = ModelFactory.get_llm(api_key, use_openai)
     embeddings = ModelFactory.get_embeddings(api_key, use_openai)
 
-    if not llm or not embeddings or not vector_store:
-        st.error("Failed to initialize models for HyDE search")
-        return [], None
+    if not llm or not embeddings:
+        raise RuntimeError("Failed to initialize models for HyDE search")
 
     prompt = f"""
     Generate a detailed flight information document that would be a perfect match for the query: "{query}"
@@ -123,16 +453,35 @@ def hyde_search(query, vector_store, api_key=None, use_openai=True, k=VECTOR_SEA
     Make sure to be specific about which airport is the departure and which is the arrival.
     """
 
-    try:
-        if hasattr(llm, 'invoke'):
-            response = llm.invoke(prompt)
-            hypothetical_doc = response.content if hasattr(response, 'content') else response
-        else:
-            hypothetical_doc = llm(prompt)
-
-        doc_embedding = embeddings.embed_query(hypothetical_doc)
-        results = vector_store.similarity_search_by_vector(doc_embedding, k=k)
-        return results, hypothetical_doc
-    except Exception as e:
-        st.error(f"HyDE search error: {str(e)}")
-        return [], None
\ No newline at end of file
+    if hasattr(llm, 'invoke'):
+        response = llm.invoke(prompt)
+        hypothetical_doc = response.content if hasattr(response, 'content') else response
+    else:
+        hypothetical_doc = llm(prompt)
+
+    # float32 keeps a cached LLaMA vector at 16KB instead of ~130KB of Python floats
+    return hypothetical_doc, array("f", embeddings.embed_query(hypothetical_doc))
+
+
+def _cached_search(key, search):
+    hits = _search_cache.get_or_load(
+        key, lambda: [(document.page_content, document.metadata) for document in search()]
+    )
+    return [Document(page_content=text, metadata=dict(metadata)) for text, metadata in hits]
+
+
+def _store_directory(vector_store):
+    # Chroma keeps its directory private
+    return getattr(vector_store, "persist_directory", None) or vector_store._persist_directory
+
+
+def _backend_id(vector_store):
+    # The embedding model and the store's version directory, which is new on
+    # every build, so hits cached before a rebuild are never served after it
+    embeddings = vector_store.embeddings
+    return getattr(embeddings, "model_id", type(embeddings).__name__), _store_directory(vector_store)
+
+
+def _normalize_search_query(query):
+    # Case is kept: the query analyzer reads capitalised airline and airport codes
+    return " ".join(query.split())
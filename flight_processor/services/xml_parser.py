@@ -1,4 +1,5 @@
 import os
+import pickle
 import json
 import xml.etree.ElementTree as ET
 import streamlit as st
@@ -7,14 +8,90 @@ from langchain.prompts import PromptTemplate
 from persistence.models import ModelFactory
 
 
-def parse_with_llm(xml_content, api_key=None, use_openai=False):
-    if use_openai:
-        return _parse_with_openai(xml_content, api_key)
-    else:
-        return _parse_atom_xml_directly(xml_content)
+EXTRACTION_SCHEMA = {
+    "properties": {
+        "airline": {"type": "string", "description": "The airline code (e.g., QFA)"},
+        "airline2": {"type": "string", "description": "The alternative airline code (e.g., QF)"},
+        "flight_number": {"type": "string", "description": "The flight number"},
+        "origin_date_local": {"type": "string", "description": "The local date of origin"},
+        "origin_date_utc": {"type": "string", "description": "The UTC date of origin"},
+        "domain": {"type": "string", "description": "Flight domain (e.g., Domestic, International)"},
+        "category": {"type": "string", "description": "Flight category from the Categories/Tag element"},
+        "departure_port": {"type": "string", "description": "Departure airport code"},
+        "departure_country": {"type": "string", "description": "Departure country code"},
+        "departure_time": {"type": "string", "description": "Scheduled departure time"},
+        "arrival_port": {"type": "string", "description": "Arrival airport code"},
+        "arrival_country": {"type": "string", "description": "Arrival country code"},
+        "arrival_time": {"type": "string", "description": "Scheduled arrival time"},
+        "status": {"type": "string", "description": "Flight status (e.g., Planned)"},
+        "aircraft_registration": {"type": "string", "description": "Aircraft registration number"},
+        "aircraft_type": {"type": "string", "description": "Aircraft type code"},
+        "aircraft_owner_airline": {"type": "string", "description": "Airline that owns the aircraft"},
+        "capacity": {"type": "integer", "description": "Aircraft capacity"}
+    },
+    "required": ["airline", "flight_number", "departure_port", "arrival_port"]
+}
+
+
+def needs_llm_completion(data):
+    return any(data.get(field) is None for field in EXTRACTION_SCHEMA["required"])
+
+
+def complete_with_llm(data, api_key=None):
+    if not needs_llm_completion(data):
+        return data
+
+    missing = [field for field in EXTRACTION_SCHEMA["properties"] if data.get(field) is None]
+    extracted = _parse_with_openai(_missing_fields_fragment(data["raw_data"], missing), api_key,
+                                   fields=missing)
+    if "error" in extracted:
+        # Keep what the parser already found; the gaps are retried on a later upload
+        return {**data, "extraction_error": extracted["error"]}
 
+    completed = dict(data)
+    for field in missing:
+        if extracted.get(field) is not None:
+            completed[field] = extracted[field]
+    return completed
 
-def _parse_with_openai(xml_content, api_key):
+
+def iter_atom_flights(source):
+    found = False
+    try:
+        for flight_elem in _iter_flight_elements(source):
+            found = True
+            data = _extract_flight_fields(flight_elem)
+            data["raw_data"] = ET.tostring(flight_elem, encoding="unicode")
+            yield data
+    except ET.ParseError as e:
+        yield {"error": f"Invalid XML: {str(e)}", "raw_data": None}
+        return
+
+    if not found:
+        yield {"error": "Flight element not found", "raw_data": None}
+
+
+def spool_atom_flights(source_path, target_path):
+    # Runs in a parser worker: flights are pickled to target_path one at a
+    # time, so neither the worker nor the app holds a whole file's flights
+    count = 0
+    with open(target_path, "wb") as target:
+        for flight_data in iter_atom_flights(source_path):
+            pickle.dump(flight_data, target, pickle.HIGHEST_PROTOCOL)
+            count += 1
+    return count
+
+
+def read_spooled_flights(path):
+    with open(path, "rb") as source:
+        while True:
+            try:
+                yield pickle.load(source)
+            except EOFError:
+                return
+
+
+def _parse_with_openai(xml_content, api_key, fields=None):
     if not api_key:
         st.error("OpenAI API key is required when using OpenAI")
         return {"error": "Missing API key", "raw_data": xml_content}
@@ -22,29 +99,12 @@ def _parse_with_openai(xml_content, api_key):
     os.environ["OPENAI_API_KEY"] = api_key
     llm = ModelFactory.get_llm(api_key, use_openai=True)
 
-    schema = {
-        "properties": {
-            "airline": {"type": "string", "description": "The airline code (e.g., QFA)"},
-            "airline2": {"type": "string", "description": "The alternative airline code (e.g., QF)"},
-            "flight_number": {"type": "string", "description": "The flight number"},
-            "origin_date_local": {"type": "string", "description": "The local date of origin"},
-            "origin_date_utc": {"type": "string", "description": "The UTC date of origin"},
-            "domain": {"type": "string", "description": "Flight domain (e.g., Domestic, International)"},
-            "category": {"type": "string", "description": "Flight category from the Categories/Tag element"},
-            "departure_port": {"type": "string", "description": "Departure airport code"},
-            "departure_country": {"type": "string", "description": "Departure country code"},
-            "departure_time": {"type": "string", "description": "Scheduled departure time"},
-            "arrival_port": {"type": "string", "description": "Arrival airport code"},
-            "arrival_country": {"type": "string", "description": "Arrival country code"},
-            "arrival_time": {"type": "string", "description": "Scheduled arrival time"},
-            "status": {"type": "string", "description": "Flight status (e.g., Planned)"},
-            "aircraft_registration": {"type": "string", "description": "Aircraft registration number"},
-            "aircraft_type": {"type": "string", "description": "Aircraft type code"},
-            "aircraft_owner_airline": {"type": "string", "description": "Airline that owns the aircraft"},
-            "capacity": {"type": "integer", "description": "Aircraft capacity"}
-        },
-        "required": ["airline", "flight_number", "departure_port", "arrival_port"]
-    }
+    schema = EXTRACTION_SCHEMA
+    if fields is not None:
+        schema = {
+            "properties": {field: EXTRACTION_SCHEMA["properties"][field] for field in fields},
+            "required": [field for field in EXTRACTION_SCHEMA["required"] if field in fields]
+        }
 
     try:
         chain = create_extraction_chain(schema, llm)
@@ -64,226 +124,115 @@ def _parse_with_openai(xml_content, api_key):
         return {"error": str(e), "raw_data": xml_content}
 
 
-def _parse_atom_xml_directly(xml_content):
-    try:
-        data = {"raw_data": xml_content}
-        root = ET.fromstring(xml_content)
-        ns = {'atom': 'urn://valence.aero/schemas/airtransport/ATOM/300'}
-
-        flight_elem = root.find('.//atom:Flight', ns)
-        if flight_elem is None:
-            return {"error": "Flight element not found", "raw_data": xml_content}
-
-        service = flight_elem.find('./atom:Service', ns)
-        if service is not None:
-            identifier = service.find('./atom:Identifier', ns)
-            if identifier is not None:
-                airline_elem = identifier.find('./atom:Airline', ns)
-                data["airline"] = airline_elem.text if airline_elem is not None else None
-
-                airline2_elem = identifier.find('./atom:Airline2', ns)
-                data["airline2"] = airline2_elem.text if airline2_elem is not None else None
-
-                flight_num_elem = identifier.find('./atom:FlightNumber', ns)
-                data["flight_number"] = flight_num_elem.text if flight_num_elem is not None else None
-
-                origin_date = identifier.find('./atom:OriginDate', ns)
-                if origin_date is not None:
-                    local_date = origin_date.find('./atom:Local', ns)
-                    data["origin_date_local"] = local_date.text if local_date is not None else None
-
-                    utc_date = origin_date.find('./atom:UTC', ns)
-                    data["origin_date_utc"] = utc_date.text if utc_date is not None else None
-
-            domain_elem = service.find('./atom:Domain', ns)
-            data["domain"] = domain_elem.text if domain_elem is not None else None
-
-            category_elem = service.find('./atom:Categories/atom:Tag', ns)
-            data["category"] = category_elem.text if category_elem is not None else None
-
-        leg = flight_elem.find('./atom:Leg', ns)
-        if leg is not None:
-            departure = leg.find('./atom:Departure', ns)
-            if departure is not None:
-                port_elem = departure.find('./atom:Port', ns)
-                if port_elem is not None:
-                    data["departure_port"] = port_elem.text
-                    data["departure_country"] = port_elem.get('Country')
-
-                schedule_elem = departure.find('./atom:Schedule', ns)
-                data["departure_time"] = schedule_elem.text if schedule_elem is not None else None
-
-            arrival = leg.find('./atom:Arrival', ns)
-            if arrival is not None:
-                port_elem = arrival.find('./atom:Port', ns)
-                if port_elem is not None:
-                    data["arrival_port"] = port_elem.text
-                    data["arrival_country"] = port_elem.get('Country')
-
-                schedule_elem = arrival.find('./atom:Schedule', ns)
-                data["arrival_time"] = schedule_elem.text if schedule_elem is not None else None
-
-            status_elem = leg.find('./atom:Status', ns)
-            data["status"] = status_elem.text if status_elem is not None else None
-
-            operation = leg.find('./atom:Operation', ns)
-            if operation is not None:
-                aircraft = operation.find('./atom:Aircraft', ns)
-                if aircraft is not None:
-                    reg_elem = aircraft.find('./atom:Registration', ns)
-                    data["aircraft_registration"] = reg_elem.text if reg_elem is not None else None
-
-                    type_elem = aircraft.find('./atom:Type', ns)
-                    data["aircraft_type"] = type_elem.text if type_elem is not None else None
-
-                    owner = aircraft.find('./atom:Owner', ns)
-                    if owner is not None:
-                        owner_airline = owner.find('./atom:Airline', ns)
-                        data["aircraft_owner_airline"] = owner_airline.text if owner_airline is not None else None
-
-                    try:
-                        physical = aircraft.find('./atom:Configuration/atom:Cabin/atom:Physical', ns)
-                        if physical is not None:
-                            capacity_elem = physical.find('./atom:Capacity', ns)
-                            data["capacity"] = int(capacity_elem.text) if capacity_elem is not None else None
-                    except (ValueError, TypeError):
-                        data["capacity"] = None
-
-        required_fields = ["airline", "flight_number", "departure_port", "arrival_port"]
-        missing_fields = [field for field in required_fields if field not in data or data[field] is None]
-
-        if missing_fields:
-            return _parse_atom_xml_without_namespaces(xml_content)
+ATOM_NAMESPACE = "urn://valence.aero/schemas/airtransport/ATOM/300"
+ET.register_namespace("atom", ATOM_NAMESPACE)
 
-        return data
+# (field, path below the Flight element, attribute or None for element text, converter)
+ATOM_FIELDS = (
+    ("airline", "Service/Identifier/Airline", None, None),
+    ("airline2", "Service/Identifier/Airline2", None, None),
+    ("flight_number", "Service/Identifier/FlightNumber", None, None),
+    ("origin_date_local", "Service/Identifier/OriginDate/Local", None, None),
+    ("origin_date_utc", "Service/Identifier/OriginDate/UTC", None, None),
+    ("domain", "Service/Domain", None, None),
+    ("category", "Service/Categories/Tag", None, None),
+    ("departure_port", "Leg/Departure/Port", None, None),
+    ("departure_country", "Leg/Departure/Port", "Country", None),
+    ("departure_time", "Leg/Departure/Schedule", None, None),
+    ("arrival_port", "Leg/Arrival/Port", None, None),
+    ("arrival_country", "Leg/Arrival/Port", "Country", None),
+    ("arrival_time", "Leg/Arrival/Schedule", None, None),
+    ("status", "Leg/Status", None, None),
+    ("aircraft_registration", "Leg/Operation/Aircraft/Registration", None, None),
+    ("aircraft_type", "Leg/Operation/Aircraft/Type", None, None),
+    ("aircraft_owner_airline", "Leg/Operation/Aircraft/Owner/Airline", None, None),
+    ("capacity", "Leg/Operation/Aircraft/Configuration/Cabin/Physical/Capacity", None, int),
+)
 
-    except Exception:
-        return _parse_atom_xml_without_namespaces(xml_content)
 
+def _compile_field_table(fields):
+    extractors = {}
+    prefixes = set()
+    for field, path, attribute, converter in fields:
+        steps = tuple(path.split("/"))
+        extractors.setdefault(steps, []).append((field, attribute, converter))
+        prefixes.update(steps[:i] for i in range(1, len(steps)))
+    return extractors, frozenset(prefixes)
 
-def _parse_atom_xml_without_namespaces(xml_content):
-    try:
-        data = {"raw_data": xml_content}
-        root = ET.fromstring(xml_content)
-
-        for elem in root.iter():
-            if '}' in elem.tag:
-                elem.tag = elem.tag.split('}')[-1]
-
-        flight_elem = root.find(".//Flight")
-        if flight_elem is None:
-            return {"error": "Flight element not found", "raw_data": xml_content}
-
-        service = flight_elem.find(".//Service")
-        if service is not None:
-            identifier = service.find(".//Identifier")
-            if identifier is not None:
-                airline_elem = identifier.find(".//Airline")
-                data["airline"] = airline_elem.text if airline_elem is not None else None
-
-                airline2_elem = identifier.find(".//Airline2")
-                data["airline2"] = airline2_elem.text if airline2_elem is not None else None
-
-                flight_num_elem = identifier.find(".//FlightNumber")
-                data["flight_number"] = flight_num_elem.text if flight_num_elem is not None else None
-
-                origin_date = identifier.find(".//OriginDate")
-                if origin_date is not None:
-                    local_date = origin_date.find(".//Local")
-                    data["origin_date_local"] = local_date.text if local_date is not None else None
-
-                    utc_date = origin_date.find(".//UTC")
-                    data["origin_date_utc"] = utc_date.text if utc_date is not None else None
-
-            domain_elem = service.find(".//Domain")
-            data["domain"] = domain_elem.text if domain_elem is not None else None
-
-            category_elem = service.find(".//Categories/Tag")
-            data["category"] = category_elem.text if category_elem is not None else None
-
-        leg = flight_elem.find(".//Leg")
-        if leg is not None:
-            departure = leg.find(".//Departure")
-            if departure is not None:
-                port_elem = departure.find(".//Port")
-                if port_elem is not None:
-                    data["departure_port"] = port_elem.text
-                    data["departure_country"] = port_elem.get('Country')
-
-                schedule_elem = departure.find(".//Schedule")
-                data["departure_time"] = schedule_elem.text if schedule_elem is not None else None
-
-            arrival = leg.find(".//Arrival")
-            if arrival is not None:
-                port_elem = arrival.find(".//Port")
-                if port_elem is not None:
-                    data["arrival_port"] = port_elem.text
-                    data["arrival_country"] = port_elem.get('Country')
-
-                schedule_elem = arrival.find(".//Schedule")
-                data["arrival_time"] = schedule_elem.text if schedule_elem is not None else None
-
-            status_elem = leg.find(".//Status")
-            data["status"] = status_elem.text if status_elem is not None else None
-
-            operation = leg.find(".//Operation")
-            if operation is not None:
-                aircraft = operation.find(".//Aircraft")
-                if aircraft is not None:
-                    reg_elem = aircraft.find(".//Registration")
-                    data["aircraft_registration"] = reg_elem.text if reg_elem is not None else None
-
-                    type_elem = aircraft.find(".//Type")
-                    data["aircraft_type"] = type_elem.text if type_elem is not None else None
-
-                    owner = aircraft.find(".//Owner")
-                    if owner is not None:
-                        owner_airline = owner.find(".//Airline")
-                        data["aircraft_owner_airline"] = owner_airline.text if owner_airline is not None else None
-
-                    try:
-                        physical = aircraft.find(".//Configuration/Cabin/Physical")
-                        if physical is not None:
-                            capacity_elem = physical.find(".//Capacity")
-                            if capacity_elem is not None and capacity_elem.text:
-                                data["capacity"] = int(capacity_elem.text)
-                    except (ValueError, TypeError):
-                        data["capacity"] = None
 
-        return data
+_ATOM_EXTRACTORS, _ATOM_PREFIXES = _compile_field_table(ATOM_FIELDS)
 
-    except Exception:
-        flight_summary = _extract_flight_summary(xml_content)
-        return {
-            "airline": flight_summary.split()[1] if len(flight_summary.split()) > 1 else None,
-            "flight_number": flight_summary.split()[2] if len(flight_summary.split()) > 2 else None,
-            "raw_data": xml_content
-        }
+
+def _local_name(tag):
+    return tag.rpartition("}")[2] if isinstance(tag, str) else None
+
+
+def _find_flight(root):
+    for elem in root.iter():
+        if _local_name(elem.tag) == "Flight":
+            return elem
+    return None
 
 
-def _extract_flight_summary(xml_content):
+def _missing_fields_fragment(xml_content, missing):
+    # Only the top-level Flight sections that hold the missing fields are sent
+    # to the LLM, falling back to the whole document when they cannot be found.
     try:
-        root = ET.fromstring(xml_content)
-        for elem in root.iter():
-            if '}' in elem.tag:
-                elem.tag = elem.tag.split('}')[-1]
-
-        flight_elem = root.find(".//Flight")
-        service = flight_elem.find(".//Service")
-        identifier = service.find(".//Identifier")
-
-        airline = identifier.find(".//Airline").text
-        flight_number = identifier.find(".//FlightNumber").text
-        flight_summary = f"Flight {airline} {flight_number}"
-
-        leg = flight_elem.find(".//Leg")
-        if leg is not None:
-            dep = leg.find(".//Departure/Port")
-            arr = leg.find(".//Arrival/Port")
-            if dep is not None and arr is not None:
-                flight_summary += f" from {dep.text} to {arr.text}"
-
-        return flight_summary
-
-    except Exception:
-        return "ATOM XML Flight Data"
\ No newline at end of file
+        flight_elem = _find_flight(ET.fromstring(xml_content))
+    except ET.ParseError:
+        return xml_content
+    if flight_elem is None:
+        return xml_content
+
+    sections = {path.split("/")[0] for field, path, _, _ in ATOM_FIELDS if field in missing}
+    parts = [ET.tostring(child, encoding="unicode") for child in flight_elem
+             if _local_name(child.tag) in sections]
+    return "".join(parts) or ET.tostring(flight_elem, encoding="unicode")
+
+
+def _iter_flight_elements(source):
+    # Finished subtrees are detached from their parent as soon as they end, so
+    # only the Flight currently being read is ever held in memory.
+    parents = []
+    flight_depth = 0
+    for event, elem in ET.iterparse(source, events=("start", "end")):
+        is_flight = _local_name(elem.tag) == "Flight"
+        if event == "start":
+            parents.append(elem)
+            flight_depth += is_flight
+            continue
+
+        parents.pop()
+        if is_flight:
+            flight_depth -= 1
+            if flight_depth == 0:
+                yield elem
+
+        if flight_depth == 0 and parents:
+            parents[-1].remove(elem)
+
+
+def _extract_flight_fields(flight_elem):
+    data = {field: None for field, _, _, _ in ATOM_FIELDS}
+    filled = set()
+
+    stack = [(child, (_local_name(child.tag),)) for child in reversed(flight_elem)]
+    while stack:
+        elem, path = stack.pop()
+
+        for field, attribute, converter in _ATOM_EXTRACTORS.get(path, ()):
+            if field in filled:
+                continue
+            filled.add(field)
+            value = elem.get(attribute) if attribute else elem.text
+            if value is not None and converter is not None:
+                try:
+                    value = converter(value)
+                except (ValueError, TypeError):
+                    value = None
+            data[field] = value
+
+        if path in _ATOM_PREFIXES:
+            stack.extend((child, path + (_local_name(child.tag),)) for child in reversed(elem))
+
+    return data
@@ -1,14 +1,28 @@
+import os
+import time
+import shutil
+import atexit
+import tempfile
 import streamlit as st
 import pandas as pd
-import tempfile
 from persistence.database import (
-    store_flight_data, get_flight_count, get_flight_sample,
-    execute_query, get_flight_by_id
+    get_flight_count, get_flight_sample,
+    get_flights_by_ids, read_connection, fetch_query_page, write_query_csv, record_query,
+    get_query_cache_stats
 )
-from services.xml_parser import parse_with_llm
-from services.vector_store import setup_vector_store, semantic_search, hyde_search
+from persistence.index_advisor import (
+    explain_query_plan, suggest_indexes, advise_recorded_queries, index_statement, create_index
+)
+from services.ingest import ingest_files
+from services.vector_store import setup_vector_store, current_vector_store, semantic_search, hyde_search, hybrid_search
+from services.answer_context import build_answer_context
 from persistence.models import ModelFactory, generate_answer
-from config import EXAMPLE_QUERIES
+from config import (
+    EXAMPLE_QUERIES, QUERY_DISPLAY_ROW_CAP, QUERY_EXPORT_MAX_BYTES, QUERY_EXPORT_MAX_AGE_SECONDS,
+    VECTOR_SEARCH_TOP_K, ANSWER_CONTEXT_HITS
+)
+
+_export_dir = None
 
 
 def render_upload_tab(session_state):
@@ -34,42 +48,56 @@ def render_upload_tab(session_state):
             st.error("OpenAI API key is required")
         else:
             with st.spinner("Processing files..."):
-                success_count = 0
-                with tempfile.TemporaryDirectory() as temp_dir:
-                    for uploaded_file in uploaded_files:
-                        xml_content = uploaded_file.read().decode("utf-8")
-
-                        with st.status(f"Processing {uploaded_file.name}..."):
-                            st.write("Extracting data...")
-                            flight_data = parse_with_llm(xml_content, api_key, use_openai=use_openai)
-
-                            st.write("Storing in database...")
-                            if store_flight_data(flight_data):
-                                success_count += 1
-                                st.write("✅ Successfully processed")
-                            else:
-                                st.write("❌ Failed to store data")
+                progress_bar = st.progress(0.0, text=f"Processing {len(uploaded_files)} files...")
+                with st.status(f"Processing {len(uploaded_files)} files...") as status:
+                    def report_progress(name, done, total):
+                        progress_bar.progress(done / total, text=f"Parsed {done} of {total} files")
+                        st.write(f"Parsed {name}")
+
+                    summary, stats = ingest_files(
+                        [(uploaded_file.name, uploaded_file) for uploaded_file in uploaded_files],
+                        api_key,
+                        use_openai=use_openai,
+                        on_progress=report_progress
+                    )
+
+                    for file_summary in summary:
+                        name = file_summary["name"]
+                        if file_summary["skipped"]:
+                            st.write(f"⏭️ {name}: already ingested, skipped")
+                        for error in file_summary["errors"]:
+                            st.write(f"❌ {name}: {error}")
+                        if file_summary["stored"]:
+                            st.write(f"✅ {name}: stored {file_summary['stored']} flights")
+                        if file_summary["failed"]:
+                            st.write(f"❌ {name}: failed to store {file_summary['failed']} flights")
+                    status.update(label="Files processed", state="complete")
+
+                success_count = sum(file_summary["stored"] for file_summary in summary)
+                st.write(
+                    f"Duplicate files skipped: {stats['files_skipped']} · "
+                    f"Extraction cache hits: {stats['extraction_cache_hits']} · "
+                    f"misses: {stats['extraction_cache_misses']}"
+                )
 
                 if success_count > 0:
                     st.write(f"Creating vector store for semantic search using {'OpenAI' if use_openai else 'LLaMA'} embeddings...")
-                    from persistence.database import get_db_connection
-                    thread_db_conn = get_db_connection()
-
-                    session_state.vector_store = setup_vector_store(
-                        thread_db_conn,
-                        api_key=api_key,
-                        use_openai=use_openai
-                    )
-
-                    thread_db_conn.close()
+                    with read_connection() as db_conn:
+                        session_state.vector_store = setup_vector_store(
+                            db_conn,
+                            api_key=api_key,
+                            use_openai=use_openai
+                        )
 
                     if session_state.vector_store:
                         session_state.processed_files = True
-                        st.success(f"Successfully processed {success_count} files and created vector store")
+                        st.success(f"Successfully processed {success_count} flights and created vector store")
                     else:
                         st.error("Failed to create vector store")
+                elif stats["files_skipped"] == len(uploaded_files):
+                    st.info("All files were already ingested")
                 else:
-                    st.error("No files were successfully processed")
+                    st.error("No flights were successfully processed")
 
     if session_state.processed_files:
         st.subheader("Database Summary")
@@ -95,25 +123,121 @@ def render_query_tab(session_state):
                                  height=100)
 
         if st.button("Run Query"):
-            try:
-                columns, data = execute_query(sql_query)
-
-                if data:
-                    df = pd.DataFrame(data, columns=columns)
-                    st.dataframe(df)
+            record_query(sql_query)
+            _discard_query_export(session_state)
+            session_state.query_sql = sql_query
+            session_state.query_cursors = [None]
+
+        if session_state.query_sql:
+            _render_query_results(session_state)
+
+        cache_stats = get_query_cache_stats()
+        st.caption(f"Result cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses "
+                   f"({cache_stats['hit_rate']:.0%} hit rate, {cache_stats['bytes'] / 1024 ** 2:.1f} MB)")
+
+        with st.expander("Index advisor"):
+            # Planning every recorded query is too slow to repeat on each rerun,
+            # so the advice is kept until it is asked for again
+            if st.button("Analyze recorded queries"):
+                session_state.index_advice = advise_recorded_queries()
+            advice = session_state.index_advice
+            if advice is None:
+                st.write("Analyze the queries run so far to find missing indexes")
+            elif not advice:
+                st.write("No missing indexes detected for the queries run so far")
+            for entry in advice or []:
+                st.write(f"`{entry['statement']}` — would help {entry['queries']} "
+                         f"queries run {entry['runs']} times")
+                if st.button("Create index", key=f"create_index_{'_'.join(entry['columns'])}"):
+                    try:
+                        create_index(entry["columns"])
+                        session_state.index_advice = None
+                        st.success(f"Created index on {', '.join(entry['columns'])}")
+                    except Exception as e:
+                        st.error(f"Failed to create index: {str(e)}")
+
+
+def _render_query_results(session_state):
+    sql_query = session_state.query_sql
+    try:
+        columns, data, next_cursor, truncated = fetch_query_page(sql_query, session_state.query_cursors[-1])
+
+        if data:
+            st.caption(f"Page {len(session_state.query_cursors)} · {len(data)} rows")
+            st.dataframe(pd.DataFrame(data, columns=columns))
+
+            previous_col, next_col = st.columns(2)
+            if previous_col.button("Previous page", disabled=len(session_state.query_cursors) == 1):
+                session_state.query_cursors.pop()
+                st.rerun()
+            if next_col.button("Next page", disabled=next_cursor is None):
+                session_state.query_cursors.append(next_cursor)
+                st.rerun()
+            if truncated:
+                st.caption(f"Showing the first {QUERY_DISPLAY_ROW_CAP} rows; export to CSV for the full result")
+
+            if st.button("Prepare CSV export"):
+                _discard_query_export(session_state)
+                _sweep_query_exports()
+                with tempfile.NamedTemporaryFile("w", suffix=".csv", newline="", encoding="utf-8",
+                                                 dir=_query_export_dir(), delete=False) as csv_file:
+                    row_count = write_query_csv(sql_query, csv_file)
+                session_state.query_export_path = csv_file.name
+                if os.path.getsize(csv_file.name) > QUERY_EXPORT_MAX_BYTES:
+                    _discard_query_export(session_state)
+                    st.warning(f"The export is larger than {QUERY_EXPORT_MAX_BYTES // 1024 ** 2} MB, "
+                               f"which is too much to offer as a download; narrow the query and try again")
+                else:
+                    st.write(f"Exported {row_count} rows")
 
-                    csv = df.to_csv(index=False)
+            if session_state.query_export_path and os.path.exists(session_state.query_export_path):
+                # Streamlit reads the file into memory on each rerun the button
+                # is shown, which QUERY_EXPORT_MAX_BYTES keeps bounded
+                with open(session_state.query_export_path, "rb") as csv_file:
                     st.download_button(
                         label="Download results as CSV",
-                        data=csv,
+                        data=csv_file,
                         file_name="flight_query_results.csv",
                         mime="text/csv"
                     )
-                else:
-                    st.info("No results found")
+        else:
+            st.info("No results found")
+
+        with st.expander("Query plan"):
+            plan = explain_query_plan(sql_query)
+            st.code("\n".join(f"{'  ' * depth}{detail}" for depth, detail in plan))
+            for columns in suggest_indexes(sql_query, plan):
+                st.write(f"💡 Suggested index: `{index_statement(columns)}`")
+
+    except Exception as e:
+        st.error(f"Query error: {str(e)}")
+
+
+def _discard_query_export(session_state):
+    if session_state.query_export_path and os.path.exists(session_state.query_export_path):
+        os.remove(session_state.query_export_path)
+    session_state.query_export_path = None
+
 
-            except Exception as e:
-                st.error(f"Query error: {str(e)}")
+def _query_export_dir():
+    # One directory per process, removed when the process exits
+    global _export_dir
+    if _export_dir is None:
+        _export_dir = tempfile.mkdtemp(prefix="flight_query_exports_")
+        atexit.register(shutil.rmtree, _export_dir, True)
+    return _export_dir
+
+
+def _sweep_query_exports():
+    # Streamlit gives no signal when a session ends, so exports left behind by
+    # closed sessions are removed once they are old enough
+    cutoff = time.time() - QUERY_EXPORT_MAX_AGE_SECONDS
+    for entry in os.scandir(_query_export_dir()):
+        try:
+            if entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+        except OSError:
+            pass
 
 
 def render_search_tab(session_state):
@@ -135,7 +259,7 @@ def render_search_tab(session_state):
 
         search_method = st.radio(
             "Search Method",
-            ["Standard Vector Search", "HyDE (Hypothetical Document Embeddings)"],
+            ["Standard Vector Search", "HyDE (Hypothetical Document Embeddings)", "Hybrid (Keyword + Vector)"],
             horizontal=True,
             key="search_method_radio"
         )
@@ -149,12 +273,18 @@ def render_search_tab(session_state):
                 return
 
             with st.spinner("Searching..."):
+                session_state.vector_store = current_vector_store(session_state.vector_store, api_key, use_openai)
+                # More hits are fetched than shown, so the answer can draw on them too
                 if search_method == "Standard Vector Search":
-                    results = semantic_search(session_state.vector_store, query)
+                    results = semantic_search(session_state.vector_store, query, k=ANSWER_CONTEXT_HITS)
+                    hypothetical_doc = None
+                elif search_method == "Hybrid (Keyword + Vector)":
+                    results = hybrid_search(query, session_state.vector_store, use_openai=use_openai,
+                                            k=ANSWER_CONTEXT_HITS)
                     hypothetical_doc = None
                 else:
                     results, hypothetical_doc = hyde_search(
-                        query, session_state.vector_store, api_key, use_openai=use_openai
+                        query, session_state.vector_store, api_key, use_openai=use_openai, k=ANSWER_CONTEXT_HITS
                     )
 
                     if hypothetical_doc:
@@ -163,51 +293,40 @@ def render_search_tab(session_state):
 
                 st.subheader("Search Results")
 
-                if results:
-                    for i, doc in enumerate(results):
+                columns, flights = get_flights_by_ids(doc.metadata["id"] for doc in results)
+                if flights:
+                    for i, flight_data in enumerate(flights[:VECTOR_SEARCH_TOP_K]):
                         result_container = st.container()
                         with result_container:
                             st.markdown(f"### Result {i + 1}")
-                            flight_id = doc.metadata["id"]
-                            columns, flight_data = get_flight_by_id(flight_id)
+                            flight_dict = {col: val for col, val in zip(columns, flight_data) if val is not None}
 
-                            if flight_data:
-                                flight_dict = {col: val for col, val in zip(columns, flight_data)
-                                               if col != 'raw_data' and val is not None}
+                            st.write(f"**Flight {flight_dict.get('airline')} {flight_dict.get('flight_number')}**")
+                            st.write(f"Date: {flight_dict.get('origin_date_local')}")
+                            st.write(
+                                f"Route: {flight_dict.get('departure_port')} ({flight_dict.get('departure_time')}) → {flight_dict.get('arrival_port')} ({flight_dict.get('arrival_time')})")
+                            st.write(
+                                f"Aircraft: {flight_dict.get('aircraft_type')} (Registration: {flight_dict.get('aircraft_registration')})")
+                            st.write(f"Status: {flight_dict.get('status')}")
 
-                                st.write(f"**Flight {flight_dict.get('airline')} {flight_dict.get('flight_number')}**")
-                                st.write(f"Date: {flight_dict.get('origin_date_local')}")
-                                st.write(
-                                    f"Route: {flight_dict.get('departure_port')} ({flight_dict.get('departure_time')}) → {flight_dict.get('arrival_port')} ({flight_dict.get('arrival_time')})")
-                                st.write(
-                                    f"Aircraft: {flight_dict.get('aircraft_type')} (Registration: {flight_dict.get('aircraft_registration')})")
-                                st.write(f"Status: {flight_dict.get('status')}")
-
-                                with st.expander(f"Show Full Details for Flight {flight_dict.get('airline')} {flight_dict.get('flight_number')}"):
-                                    st.json(flight_dict)
+                            with st.expander(f"Show Full Details for Flight {flight_dict.get('airline')} {flight_dict.get('flight_number')}"):
+                                st.json(flight_dict)
 
                             st.markdown("---")
                 else:
                     st.info("No matching flights found")
 
-                columns, flight_data = execute_query(
-                    """
-                    SELECT airline,
-                           flight_number,
-                           origin_date_local,
-                           departure_port,
-                           departure_time,
-                           arrival_port,
-                           arrival_time
-                    FROM flights
-                    LIMIT 20
-                    """
-                )
-
                 llm = ModelFactory.get_llm(api_key, use_openai=use_openai)
                 answer = ""
-                if not use_openai:
-                    answer = generate_answer(llm, query, flight_data)
+                if not use_openai and not flights:
+                    # Nothing matched, so there is nothing to ground an answer in
+                    answer = "I don't have enough information about that."
+                elif not use_openai and llm:
+                    flight_context, used = build_answer_context(query, columns, flights, llm.get_num_tokens)
+                    st.caption(f"Answering from the top {used} of {len(flights)} matching flights")
+                    answer = generate_answer(llm, query, flight_context)
+                elif not use_openai:
+                    answer = generate_answer(llm, query, "")
 
                 st.markdown("### AI Answer")
                 st.write(answer)
\ No newline at end of file